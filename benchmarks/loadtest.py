@@ -0,0 +1,236 @@
+"""Load test for the newtabmagic documentation server.
+
+Start a server on a free port, request a weighted mix of module pages,
+class pages, the module index and searches from concurrent clients
+over loopback, and report throughput, latency percentiles and errors:
+
+    python benchmarks/loadtest.py --clients 20 --duration 10
+
+Use --url to test a server that is already running, and --mix to
+change the weights, e.g. --mix module=1,search=1.  Searches import
+every module on sys.path, so they are not in the default mix.
+
+Runs offline; nothing but the server on 127.0.0.1 is contacted.
+"""
+from __future__ import division, print_function
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import urlopen, HTTPError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import newtabmagic  # noqa: E402
+
+MODULES = ['json', 'os', 'collections', 'email.message', 'http.server']
+CLASSES = ['json.decoder.JSONDecoder', 'collections.OrderedDict',
+           'http.server.HTTPServer', 'email.message.Message']
+SEARCHES = ['json', 'http']
+DEFAULT_MIX = 'module=5,class=4,index=1,search=0'
+KINDS = ('module', 'class', 'index', 'search')
+
+
+def page_paths(kind, names):
+    """Request paths for a kind of page."""
+    if kind == 'index':
+        return ['/']
+    elif kind == 'search':
+        return ['/search?key=' + name for name in names]
+    return ['/' + name + '.html' for name in names]
+
+
+def parse_mix(mix):
+    """Parse 'kind=weight,...' into a dict.  Raises
+    argparse.ArgumentTypeError for unknown kinds or bad weights."""
+    weights = {}
+    for item in mix.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(
+                'unknown page kind {!r} (choose from {})'.format(
+                    kind, ', '.join(KINDS)))
+        try:
+            weights[kind] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                'bad weight {!r} for {}'.format(weight, kind))
+    return weights
+
+
+def start_server(port, options):
+    """Run newtabmagic.serve in a child process; return the process
+    once the server answers requests."""
+    code = ('import sys\n'
+            'sys.path.insert(0, {root!r})\n'
+            'import newtabmagic\n'
+            'newtabmagic.serve({port}, **{options!r})')
+    code = code.format(root=ROOT, port=port, options=options)
+    process = subprocess.Popen([sys.executable, '-c', code])
+    url = 'http://127.0.0.1:{}{}'.format(port, newtabmagic.STATS_PATH)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urlopen(url, timeout=1).read()
+            return process
+        except IOError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('server did not start')
+
+
+def fetch(url, timeout):
+    """Request url; return (latency in seconds, bytes, error or None)."""
+    start = time.time()
+    try:
+        response = urlopen(url, timeout=timeout)
+        size = len(response.read())
+        error = None if response.getcode() == 200 else response.getcode()
+    except HTTPError as e:
+        size, error = 0, e.code
+    except Exception as e:  # pylint: disable=W0703
+        size, error = 0, type(e).__name__
+    return time.time() - start, size, error
+
+
+def client(base_url, requests, deadline, max_requests, seed, timeout,
+           results):
+    """Request randomly chosen pages until the deadline."""
+    rng = random.Random(seed)
+    total = sum(weight for _, _, weight in requests)
+    count = 0
+    while time.time() < deadline and count < max_requests:
+        choice = rng.uniform(0, total)
+        for kind, path, weight in requests:
+            choice -= weight
+            if choice <= 0:
+                break
+        latency, size, error = fetch(base_url + path, timeout)
+        results.append((kind, latency, size, error))
+        count += 1
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return float('nan')
+    rank = max(int(round(fraction * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def report(results, elapsed, clients):
+    """Print throughput, latency percentiles and error rates."""
+    errors = [r for r in results if r[3] is not None]
+    print('clients: {}  elapsed: {:.1f}s  requests: {}  errors: {} '
+          '({:.1f}%)'.format(clients, elapsed, len(results), len(errors),
+                             100.0 * len(errors) / max(len(results), 1)))
+    print('throughput: {:.1f} requests/s, {:.0f} KB/s'.format(
+        len(results) / elapsed,
+        sum(r[2] for r in results) / 1024.0 / elapsed))
+    print('{:<8}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}'.format(
+        'kind', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+    kinds = sorted(set(r[0] for r in results))
+    for kind in ['all'] + kinds:
+        rows = [r for r in results if kind in ('all', r[0])]
+        latencies = sorted(1000 * r[1] for r in rows)
+        print('{:<8}{:>8}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+            kind, len(rows), len([r for r in rows if r[3] is not None]),
+            percentile(latencies, 0.50), percentile(latencies, 0.95),
+            percentile(latencies, 0.99), percentile(latencies, 1.0)))
+    counts = {}
+    for r in errors:
+        counts[r[3]] = counts.get(r[3], 0) + 1
+    for error, count in sorted(counts.items(), key=str):
+        print('error {}: {}'.format(error, count))
+
+
+def main(argv=None):
+    """Run the load test."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', help='Test a running server at this url.')
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='Seconds to run (default 10).')
+    parser.add_argument('--requests', type=int, default=sys.maxsize,
+                        help='Maximum requests per client.')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='Weights of page kinds (default %(default)s).')
+    parser.add_argument('--modules', nargs='+', default=MODULES)
+    parser.add_argument('--classes', nargs='+', default=CLASSES)
+    parser.add_argument('--searches', nargs='+', default=SEARCHES)
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='Seconds to wait for a response.')
+    parser.add_argument('--no-warmup', action='store_true',
+                        help='Do not request each page once before timing.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-rss', type=int, default=0,
+                        help='Passed to the server (megabytes).')
+    parser.add_argument('--archive', help='Passed to the server.')
+    args = parser.parse_args(argv)
+
+    names = {'module': args.modules, 'class': args.classes,
+             'index': [], 'search': args.searches}
+    requests = []
+    for kind, weight in args.mix.items():
+        if weight > 0:
+            paths = page_paths(kind, names[kind])
+            requests.extend((kind, path, weight / len(paths))
+                            for path in paths)
+    if not requests:
+        parser.error('--mix has no page kinds with positive weight')
+
+    process = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        port = newtabmagic._port_not_in_use()
+        options = {'max_rss': args.max_rss, 'archive': args.archive}
+        process = start_server(port, options)
+        base_url = 'http://127.0.0.1:{}'.format(port)
+    try:
+        if not args.no_warmup:
+            for _, path, _ in requests:
+                fetch(base_url + path, args.timeout)
+        results = []
+        start = time.time()
+        deadline = start + args.duration
+        threads = [threading.Thread(
+            target=client,
+            args=(base_url, requests, deadline, args.requests,
+                  args.seed + i, args.timeout, results))
+                   for i in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report(results, time.time() - start, args.clients)
+        try:
+            stats = json.loads(urlopen(base_url + newtabmagic.STATS_PATH)
+                               .read().decode('utf-8'))
+        except (IOError, ValueError) as e:
+            # Not a newtabmagic server, or an older one.
+            print('\nno server statistics: {}'.format(e))
+        else:
+            print()
+            print(newtabmagic.format_stats(stats))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Measure the IPython startup time saved by newtabmagic_lazy.
+
+Each run starts a new interpreter with an IPython shell, then times
+either the three cells of the old startup file,
+
+    %load_ext newtabmagic
+    %newtab --port 8880
+    %newtab --browser firefox
+
+or newtabmagic_lazy.register() with the same settings:
+
+    python benchmarks/startup.py --runs 10
+"""
+from __future__ import division, print_function
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETUP = '''
+import sys, time
+sys.path.insert(0, {root!r})
+from IPython.core.interactiveshell import InteractiveShell
+ip = InteractiveShell.instance()
+start = time.time()
+'''
+
+EAGER = '''
+ip.run_cell('%load_ext newtabmagic')
+ip.run_cell('%newtab --port 8880')
+ip.run_cell('%newtab --browser firefox')
+'''
+
+LAZY = '''
+import newtabmagic_lazy
+newtabmagic_lazy.register(ip, port=8880, browser='firefox')
+'''
+
+REPORT = '''
+print(time.time() - start)
+'''
+
+
+def time_startup(code):
+    """Run code in a new interpreter; return the seconds it reported."""
+    code = SETUP.format(root=ROOT) + code + REPORT
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return float(output.decode('ascii').split()[-1])
+
+
+def median(values):
+    """Median of values."""
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def main(argv=None):
+    """Run the measurement."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    eager = median([time_startup(EAGER) for _ in range(args.runs)])
+    lazy = median([time_startup(LAZY) for _ in range(args.runs)])
+    print('%load_ext newtabmagic + 2 cells: {:.1f} ms'.format(1000 * eager))
+    print('newtabmagic_lazy.register:       {:.1f} ms'.format(1000 * lazy))
+    print('saved:                           {:.1f} ms'.format(
+        1000 * (eager - lazy)))
+
+
+if __name__ == '__main__':
+    main()
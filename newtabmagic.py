@@ -4,19 +4,58 @@ from __future__ import print_function
 
 __version__ = '0.2.0.dev0'
 
+import atexit
+import collections
+import cProfile
 import inspect
 import fullqualname
+import json
+import marshal
+import mmap
 import operator
 import os
+import pkgutil
+import pstats
 import pydoc
+import re
+import select
+import signal
 import socket
+import struct
 import subprocess
 import sys
+import tempfile
+import threading
 import time
+import traceback
 import webbrowser
+import zipfile
 
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from queue import Queue
+    from socketserver import ThreadingMixIn
+    from urllib.error import HTTPError
+    from urllib.parse import parse_qs, quote
+    from urllib.request import Request, urlopen
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from Queue import Queue
+    from SocketServer import ThreadingMixIn
+    from urllib import quote
+    from urllib2 import HTTPError, Request, urlopen
+    from urlparse import parse_qs
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    from traitlets import Bool
+except ImportError:
+    from IPython.utils.traitlets import Bool
 
-from IPython import get_ipython
 from IPython.core.error import UsageError
 from IPython.core.magic import (
     Magics,
@@ -32,10 +71,24 @@ from IPython.core.magic_arguments import (
 class NewTabMagics(Magics):
     """Magic class for opening new browser tabs."""
 
+    async_default = Bool(
+        False, config=True,
+        help=("Run %newtab in the background unless --sync or --json is "
+              "given."))
+
     def __init__(self, shell):
         super(NewTabMagics, self).__init__(shell)
+        self._jobs = JobQueue()
         self._browser = None
         self._server = ServerProcess()
+        self._live_docs = LiveDocs()
+        self._server.live_docs = self._live_docs
+        self._live_refresh = False
+        self._launcher = BrowserLauncher()
+        self._warmer = DocWarmer(self._server)
+        self._warm = False
+        self._dedup_window = 5.0
+        self._opened = {}
 
     @line_magic
     @magic_arguments()
@@ -55,84 +108,376 @@ class NewTabMagics(Magics):
         help='Specify port used by pydoc server.',
         type=int,
     )
+    @argument(
+        '--idle-timeout',
+        help=('Stop pydoc server after it has been idle for this many '
+              'seconds (0 means never).'),
+        type=int,
+    )
+    @argument(
+        '--max-rss',
+        help=('Replace pydoc server process when its resident set size '
+              'exceeds this many megabytes (0 means never).'),
+        type=int,
+    )
+    @argument(
+        '--archive',
+        help=('Serve pages from an archive made by build_archive, '
+              'rendering other pages with pydoc.'),
+    )
+    @argument(
+        '--zygote',
+        help=('Start pydoc server by forking a process that has already '
+              'imported the server modules and these modules.'),
+        nargs='*',
+        metavar='MODULE',
+    )
+    @argument(
+        '--no-zygote',
+        help='Start pydoc server in a new Python process.',
+        action='store_true'
+    )
+    @argument(
+        '--dedup-window',
+        help=('Do not reopen a tab opened within this many seconds '
+              '(0 means always reopen).'),
+        type=float,
+    )
+    @argument(
+        '--force',
+        help='Open tabs even if they were opened recently.',
+        action='store_true'
+    )
+    @argument(
+        '--source',
+        help=('Open tabs showing the source code of the objects, from '
+              'their definitions.'),
+        action='store_true'
+    )
+    @argument(
+        '--warm',
+        help=('After each cell, pre-render pages of newly imported '
+              'modules in the running pydoc server.'),
+        action='store_true'
+    )
+    @argument(
+        '--no-warm',
+        help='Stop pre-rendering pages of imported modules.',
+        action='store_true'
+    )
+    @argument(
+        '--warm-allow',
+        help='Only pre-render pages of these modules (none means any).',
+        nargs='*',
+        metavar='MODULE',
+    )
+    @argument(
+        '--warm-deny',
+        help='Never pre-render pages of these modules.',
+        nargs='*',
+        metavar='MODULE',
+    )
+    @argument(
+        '--warm-limit',
+        help='Pre-render at most this many pages at once.',
+        type=int,
+    )
     @argument(
         '--server',
         help='Interact with pydoc server process.',
-        choices=['stop', 'start', 'read']
+        choices=['stop', 'start', 'read', 'stats']
+    )
+    @argument(
+        '--json',
+        help=('Return a dict describing the object: signature, docstring, '
+              'source location and members.  Runs in the foreground, and '
+              'cannot be used with --async.'),
+        metavar='NAME',
+    )
+    @argument(
+        '--json-offset',
+        help='Index of the first member returned by --json.',
+        type=int,
+        default=0,
+    )
+    @argument(
+        '--profile',
+        help=('Open a tab for NAME under the profiler and print the time '
+              'taken by each stage, in the kernel and the pydoc server.'),
+        metavar='NAME',
+    )
+    @argument(
+        '--profile-top',
+        help='Number of functions listed by --profile.',
+        type=int,
+        default=20,
+    )
+    @argument(
+        '--profile-out',
+        help='Save the kernel and server profile of --profile to FILE.',
+        metavar='FILE',
     )
     @argument(
         '--show',
         help="Show state.",
         action='store_true'
     )
+    @argument(
+        '--async',
+        help=("Return at once, doing the work in the background. Output "
+              "is printed when the work is done."),
+        action='store_true',
+        dest='run_async'
+    )
+    @argument(
+        '--sync',
+        help="Do the work before returning (the default).",
+        action='store_true'
+    )
     def newtab(self, line):
         """View documentation in the browser."""
 
         args = parse_argstring(self.newtab, line)
 
+        if args.run_async and args.json:
+            raise UsageError('--json returns a value, and cannot be used '
+                             'with --async.')
+        if (args.run_async or self.async_default) and not args.sync and \
+                not args.json:
+            self._jobs.submit(lambda: self._newtab(args))
+        else:
+            # Finish earlier background work first, to keep the order.
+            self._jobs.join()
+            return self._newtab(args)
+
+    def _newtab(self, args):
+        """Carry out a %newtab command.
+
+        Returns the description of the object named by --json, if any.
+        """
+
         if args.port is not None:
             self._server.port = args.port
 
+        if args.idle_timeout is not None:
+            self._server.idle_timeout = args.idle_timeout
+
+        if args.max_rss is not None:
+            self._server.max_rss = args.max_rss
+
+        if args.archive is not None:
+            self._server.archive = args.archive
+
+        if args.zygote is not None:
+            self._server.zygote = args.zygote
+
+        if args.no_zygote:
+            self._server.zygote = None
+
         if args.server:
             self._server_interact(args.server)
 
         if args.browser:
             self.browser = args.browser
 
+        if args.dedup_window is not None:
+            self._dedup_window = args.dedup_window
+
+        if args.warm_allow is not None:
+            self._warmer.allow = args.warm_allow
+
+        if args.warm_deny is not None:
+            self._warmer.deny = args.warm_deny
+
+        if args.warm_limit is not None:
+            self._warmer.max_warming = args.warm_limit
+
+        if args.warm:
+            self._set_warm(True)
+
+        if args.no_warm:
+            self._set_warm(False)
+
         if args.names:
-            self._open_new_tabs(args.names)
+            self._open_new_tabs(args.names, force=args.force,
+                                source=args.source)
+
+        doc = None
+        if args.json:
+            doc = self._get_json(args.json, args.json_offset)
+
+        if args.profile:
+            self._profile(args.profile, args.profile_top, args.profile_out)
 
         if args.show:
             self._show()
 
-    def _open_new_tabs(self, names):
-        """Open browser tabs for a list of variable names and paths."""
+        return doc
+
+    def _open_new_tabs(self, names, force=False, source=False):
+        """Open browser tabs for a list of variable names and paths.
+
+        Names that resolve to the same page are opened once.  Unless
+        force is true, pages opened within the last dedup_window
+        seconds are not opened again.  If source is true, the tabs show
+        source code instead of documentation.
+        """
+        now = time.time()
+        self._opened = dict((url, opened) for url, opened in
+                            self._opened.items()
+                            if now - opened < self._dedup_window)
+        seen = set()
         for name in names:
-            url = self._get_url(name)
-            if url:
-                self._open_new_tab(url)
+            url = self._get_url(name, source)
+            if not url:
+                _print('Documentation not found: {}'.format(name))
+            elif url in seen:
+                continue
+            elif url in self._opened and not force:
+                _print('Tab recently opened: {}'.format(name))
             else:
-                print('Documentation not found: {}'.format(name))
+                self._open_new_tab(url)
+                self._opened[url] = now
+            seen.add(url)
+
+    def _get_url(self, name, source=False):
+        """Get pydoc url for name of variable or path, or the url of
+        its source code if source is true.
 
-    def _get_url(self, name):
-        """Get pydoc url for name of variable or path."""
+        The server is started if it is not already running.
+        """
         page = self._get_pydoc_page_name(name)
         if page:
-            url = self.base_url + page + '.html'
+            if not self._server.running():
+                self._server.start()
+            if source:
+                url = self.base_url + SOURCE_PATH[1:] + page
+            else:
+                url = self.base_url + page + '.html'
         else:
             url = None
         return url
 
+    def _get_json(self, name, offset=0):
+        """Get the JSON description of the object for name of variable
+        or path, as a dict.
+
+        The server is started if it is not already running.
+        """
+        page = self._get_pydoc_page_name(name)
+        doc = None
+        if page:
+            if not self._server.running():
+                self._server.start()
+            doc = self._server.json(page, offset)
+        if doc is None:
+            _print('Documentation not found: {}'.format(name))
+        return doc
+
+    def _profile(self, name, top=20, path=None):
+        """Open a tab for name under the profiler, then print the time
+        taken by each stage and the functions that took most time in the
+        kernel and the server.  The profile is saved to path if given.
+        """
+        profiler = cProfile.Profile()
+        stages = []
+
+        def run(stage, func, *args):
+            start = time.time()
+            profiler.enable()
+            try:
+                return func(*args)
+            finally:
+                profiler.disable()
+                stages.append((stage, time.time() - start))
+
+        page = run('name lookup', self._get_pydoc_page_name, name)
+        if not page:
+            _print('Documentation not found: {}'.format(name))
+            return
+        if not self._server.running():
+            run('server start', self._server.start)
+        start = time.time()
+        timing, server_profile = self._server.profile_page(page)
+        stages.append(('server page', time.time() - start))
+        run('browser launch', self._open_new_tab, self.base_url + page +
+            '.html')
+
+        stats = pstats.Stats(profiler, stream=_stdout())
+        lookup = _function_times(stats, LOOKUP_FUNCTIONS)
+        if server_profile is not None:
+            stats.add(_ProfileData(server_profile))
+        _print(format_profile(stages, lookup, timing))
+        _print()
+        stats.sort_stats('tottime').print_stats(top)
+        if path:
+            stats.dump_stats(path)
+            _print('Profile saved to {}'.format(path))
+
     def _get_pydoc_page_name(self, path):
         """Return name of pydoc page, or None if path is not valid."""
         obj = _get_user_ns_object(self.shell, path)
         if obj is not None:
             page_name = _get_object_pydoc_page_name(obj)
+            live = page_name and _live_object(obj, page_name)
+            if live is not None:
+                self._register_live(page_name, live)
         else:
-            if pydoc.locate(path) is not None:
-                page_name = path
-            else:
+            obj = pydoc.locate(path)
+            if obj is None:
                 page_name = None
+            elif getattr(obj, '__module__', None) == '__main__' and \
+                    (inspect.isclass(obj) or inspect.isroutine(obj)):
+                # Defined interactively, and patched into a module.
+                page_name = _get_object_pydoc_page_name(obj)
+                self._register_live(page_name, obj)
+            else:
+                page_name = path
         return page_name
 
+    def _register_live(self, page_name, obj):
+        """Register obj with LiveDocs, serving it if the server is
+        running.  The first time, a post_execute hook is registered that
+        follows the redefinition of registered objects."""
+        self._live_docs.register(page_name, obj)
+        if self._server.running():
+            self._live_docs.start()
+        if not self._live_refresh:
+            self.shell.events.register('post_execute',
+                                       self._refresh_live_docs)
+            self._live_refresh = True
+
+    def _refresh_live_docs(self):
+        """post_execute hook: register redefined live objects."""
+        self._live_docs.refresh(self.shell.user_ns)
+
     def _open_new_tab(self, url):
         """Open a new tab in the browser."""
         if self._browser:
-            cmd = [self._browser, url]
-            try:
-                subprocess.Popen(cmd)
-            except OSError:
-                msg = "the command '{}' raised an OSError\n"
-                msg = msg.format(' '.join(cmd))
-                raise UsageError(msg)
+            self._launcher.launch([self._browser, url])
         else:
             webbrowser.open_new_tab(url)
 
+    def _set_warm(self, warm):
+        """Register or unregister the post_execute hook that warms the
+        pages of imported modules."""
+        if warm and not self._warm:
+            self._warmer.reset()
+            self.shell.events.register('post_execute',
+                                       self._warmer.post_execute)
+        elif not warm and self._warm:
+            self.shell.events.unregister('post_execute',
+                                         self._warmer.post_execute)
+        self._warm = warm
+
     def _show(self):
         """Show state of magic."""
         msg = ''
         msg += 'browser: {}\n'.format(self._browser)
-        print(msg, end='')
+        msg += 'warm: {}\n'.format(self._warm)
+        _print(msg, end='')
+        self._warmer.show()
+        self._launcher.show()
         self._server.show()
 
     def _server_interact(self, cmd):
@@ -143,14 +488,30 @@ class NewTabMagics(Magics):
             self._server.stop()
         elif cmd == 'read':
             out, err = self._server.read()
-            print('Server stdout: {}'.format(out))
-            print('Server stderr: {}'.format(err))
+            _print('Server stdout: {}'.format(out))
+            _print('Server stderr: {}'.format(err))
+        elif cmd == 'stats':
+            stats = self._server.stats()
+            if stats is None:
+                _print('Server statistics not available.')
+            else:
+                _print(format_stats(stats))
 
     @property
     def base_url(self):
         """Base url for pydoc server."""
         return self._server.url()
 
+    @property
+    def port(self):
+        """Port number of pydoc server."""
+        return self._server.port
+
+    @port.setter
+    def port(self, port):
+        """Set port number if server is not running."""
+        self._server.port = port
+
     @property
     def browser(self):
         """Name of browser used to open new tabs."""
@@ -163,36 +524,373 @@ class NewTabMagics(Magics):
         self._browser = path
 
 
+class JobQueue(object):
+    """Run jobs one at a time, in the order submitted, in a background
+    thread.
+
+    Output printed by a job with _print is collected and written in one
+    piece when the job is done, so it is not interleaved with other
+    output.  It is written to sys.stdout as it was when the job was
+    submitted.
+    """
+
+    def __init__(self):
+        self._queue = Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, job):
+        """Queue a function to be called with no arguments."""
+        self._queue.put((job, sys.stdout))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def join(self):
+        """Wait until all submitted jobs are done."""
+        self._queue.join()
+
+    def _work(self):
+        """Run queued jobs."""
+        while True:
+            job, stream = self._queue.get()
+            output = StringIO()
+            _job_output.stream = output
+            try:
+                try:
+                    job()
+                except UsageError as e:
+                    _print('UsageError: {}'.format(e))
+                except Exception:  # pylint: disable=W0703
+                    traceback.print_exc(file=output)
+                _job_output.stream = None
+                if output.getvalue():
+                    stream.write(output.getvalue())
+                    stream.flush()
+            finally:
+                _job_output.stream = None
+                self._queue.task_done()
+
+
+# Output buffer of the job run by the current thread, if any.
+_job_output = threading.local()
+
+
+def _stdout():
+    """Stream for output of the current thread: the output buffer of
+    the job it is running, or sys.stdout."""
+    stream = getattr(_job_output, 'stream', None)
+    return sys.stdout if stream is None else stream
+
+
+def _print(*args, **kwargs):
+    """print() to _stdout()."""
+    kwargs.setdefault('file', _stdout())
+    print(*args, **kwargs)
+
+
+class BrowserLauncher(object):
+    """Launch browser commands and reap the launched processes.
+
+    At most max_launching launches run at once.  A launch lasts until
+    its process exits or has run for launch_timeout seconds, since a
+    command that starts the browser itself keeps running.  Its latency
+    is the time it lasted, and it failed if its process exited with a
+    nonzero status within that time.  Exited processes are reaped by a
+    background thread.
+    """
+
+    def __init__(self, max_launching=4, launch_timeout=5.0):
+        self.max_launching = max_launching
+        self.launch_timeout = launch_timeout
+        self.launches = 0
+        self.failures = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._latency_count = 0
+        self._children = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def launch(self, cmd):
+        """Run cmd in a child process, waiting for a free slot first."""
+        self._wait_for_slot()
+        start = time.time()
+        try:
+            process = subprocess.Popen(cmd)
+        except OSError:
+            with self._lock:
+                self.failures += 1
+            msg = "the command '{}' raised an OSError\n"
+            msg = msg.format(' '.join(cmd))
+            raise UsageError(msg)
+        with self._lock:
+            self.launches += 1
+            # [start time, whether the launch is over]
+            self._children[process] = [start, False]
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_children)
+                self._reaper.daemon = True
+                self._reaper.start()
+
+    def running(self):
+        """Number of launched processes that have not exited."""
+        with self._lock:
+            self._reap()
+            return len(self._children)
+
+    def show(self):
+        """Show state."""
+        running = self.running()
+        msg = ''
+        msg += 'browser launches: {}\n'.format(self.launches)
+        msg += 'browser launch failures: {}\n'.format(self.failures)
+        msg += 'browser launches running: {}\n'.format(running)
+        if self._latency_count:
+            mean = self._latency_total / self._latency_count
+            latency = '{:.3f}s mean, {:.3f}s max'
+            latency = latency.format(mean, self._latency_max)
+            msg += 'browser launch latency: {}\n'.format(latency)
+        _print(msg, end='')
+
+    def _wait_for_slot(self):
+        """Wait until fewer than max_launching launches are running."""
+        while True:
+            with self._lock:
+                self._reap()
+                now = time.time()
+                launching = [start for start, over in self._children.values()
+                             if not over and now - start < self.launch_timeout]
+            if len(launching) < self.max_launching:
+                return
+            time.sleep(0.05)
+
+    def _reap_children(self):
+        """Reap exited children until none are left."""
+        while True:
+            time.sleep(0.2)
+            with self._lock:
+                self._reap()
+                if not self._children:
+                    self._reaper = None
+                    return
+
+    def _reap(self):
+        """Record launches that are over, and collect exit status of
+        exited children.  Call with the lock held."""
+        now = time.time()
+        for process, launch in list(self._children.items()):
+            start, over = launch
+            status = process.poll()
+            elapsed = now - start
+            if not over and (status is not None or
+                             elapsed >= self.launch_timeout):
+                launch[1] = True
+                if status is not None and status != 0:
+                    self.failures += 1
+                latency = min(elapsed, self.launch_timeout)
+                self._latency_total += latency
+                self._latency_count += 1
+                self._latency_max = max(self._latency_max, latency)
+            if status is not None:
+                del self._children[process]
+
+
+class DocWarmer(object):
+    """Pre-render module pages in the pydoc server after cells import
+    new modules.
+
+    post_execute, run after each cell, queues the top-level modules
+    added to sys.modules since it last ran.  While the server is
+    running, up to max_warming background threads request their pages,
+    so that the server has imported the modules and rendered their
+    pages before a tab is opened.  If allow is not empty only modules
+    in it are warmed; modules in deny and private modules never are.
+    """
+
+    def __init__(self, server, max_warming=2, timeout=60.0):
+        self.max_warming = max_warming
+        self.timeout = timeout
+        self.allow = []
+        self.deny = []
+        self.warmed = 0
+        self.failures = 0
+        self._server = server
+        self._seen = _top_level_modules()
+        self._queue = []
+        self._warming = 0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Forget queued modules; only modules imported after this are
+        warmed."""
+        with self._lock:
+            self._seen = _top_level_modules()
+            del self._queue[:]
+
+    def post_execute(self):
+        """Queue newly imported modules and start warming them."""
+        modules = _top_level_modules()
+        with self._lock:
+            new = modules - self._seen
+            self._seen |= new
+            self._queue.extend(name for name in sorted(new)
+                               if self._wanted(name))
+        if self._server.running():
+            self._start_threads()
+
+    def show(self):
+        """Show state."""
+        with self._lock:
+            queued = len(self._queue)
+            warming = self._warming
+        msg = ''
+        msg += 'warm allow: {}\n'.format(' '.join(self.allow) or 'any')
+        msg += 'warm deny: {}\n'.format(' '.join(self.deny) or 'none')
+        msg += 'warm limit: {}\n'.format(self.max_warming)
+        queue = '{} queued, {} warming, {} warmed, {} failed'
+        queue = queue.format(queued, warming, self.warmed, self.failures)
+        msg += 'warm queue: {}\n'.format(queue)
+        _print(msg, end='')
+
+    def _wanted(self, name):
+        """Should the module be warmed?"""
+        if name.startswith('_') or name in self.deny:
+            return False
+        return not self.allow or name in self.allow
+
+    def _start_threads(self):
+        """Start threads until max_warming are running or each queued
+        module has one."""
+        with self._lock:
+            count = min(self.max_warming - self._warming, len(self._queue))
+            self._warming += max(count, 0)
+        for _ in range(count):
+            thread = threading.Thread(target=self._warm_queued)
+            thread.daemon = True
+            thread.start()
+
+    def _warm_queued(self):
+        """Request pages of queued modules until the queue is empty."""
+        finished = False
+        try:
+            while True:
+                with self._lock:
+                    if not self._queue:
+                        self._warming -= 1
+                        finished = True
+                        return
+                    name = self._queue.pop(0)
+                try:
+                    urlopen(self._server.url() + name + '.html',
+                            timeout=self.timeout).read()
+                    warmed = True
+                except Exception:  # pylint: disable=W0703
+                    # Such as IOError, or http.client.IncompleteRead.
+                    warmed = False
+                with self._lock:
+                    if warmed:
+                        self.warmed += 1
+                    else:
+                        self.failures += 1
+        finally:
+            if not finished:
+                with self._lock:
+                    self._warming -= 1
+
+
+def _top_level_modules():
+    """Names of the top-level packages and modules in sys.modules."""
+    return set(name.partition('.')[0]
+               for name, module in list(sys.modules.items())
+               if module is not None)
+
+
 class ServerProcess(object):
     """Wrapper for the web server process."""
 
     def __init__(self):
         self._process = None
         self._port = 0
+        self._idle_timeout = 0
+        self._max_rss = 0
+        self._archive = None
+        self._zygote = None
+        self._output = None
+        self._stop_at_exit = False
+        self.live_docs = None
+
+    # Seconds start() waits for a new server to accept connections.
+    start_timeout = 10.0
 
     def start(self):
-        """Start server if not previously started."""
+        """Start server if not previously started.
+
+        Raises UsageError if the server exits, or does not accept
+        connections within start_timeout seconds.
+        """
         msg = ''
         if not self.running():
             if self._port == 0:
                 self._port = _port_not_in_use()
-            self._process = start_server_background(self._port)
+            options = dict(idle_timeout=self._idle_timeout,
+                           max_rss=self._max_rss,
+                           archive=self._archive)
+            if self.live_docs is not None:
+                options['live_url'] = self.live_docs.start()
+            self._process = None
+            if self._zygote is not None:
+                try:
+                    self._process = self._zygote.fork_server(
+                        self._port, **options)
+                except (IOError, OSError, ValueError) as e:
+                    _print('Zygote could not start server: {}'.format(e))
+            if self._process is None:
+                self._output = (tempfile.TemporaryFile(),
+                                tempfile.TemporaryFile())
+                self._process = start_server_background(
+                    self._port, stdout=self._output[0],
+                    stderr=self._output[1], **options)
+                if not self._stop_at_exit:
+                    atexit.register(self._stop_quietly)
+                    self._stop_at_exit = True
+            if not _wait_for_port(self._port, self.start_timeout,
+                                  self.running):
+                raise UsageError(self._start_error())
         else:
             msg = 'Server already started\n'
         msg += 'Server running at {}'.format(self.url())
-        print(msg)
+        _print(msg)
+
+    def _start_error(self):
+        """Message explaining why a new server is not ready."""
+        if self.running():
+            return ('Server could not be started: not accepting '
+                    'connections after {}s'.format(self.start_timeout))
+        msg = 'Server could not be started'
+        err = self.read()[1].strip()
+        if err:
+            # The last line of a traceback holds the exception.
+            msg += ': {}'.format(err.splitlines()[-1])
+        return msg
 
     def read(self):
-        """Read stdout and stdout pipes if process is no longer running."""
-        if self._process and self._process.poll() is not None:
-            ip = get_ipython()
-            err = ip.user_ns['error'].read().decode()
-            out = ip.user_ns['output'].read().decode()
-        else:
-            out = ''
-            err = ''
+        """Read stdout and stderr if process is no longer running."""
+        out = ''
+        err = ''
+        if self._process and self._process.poll() is not None and \
+                not isinstance(self._process, ForkedServer):
+            out, err = [_read_file(f) for f in self._output]
         return out, err
 
+    def _stop_quietly(self):
+        """Stop the server process, if it is running, when IPython
+        exits."""
+        if self.running():
+            self._process.terminate()
+
     def stop(self):
         """Stop server process."""
 
@@ -201,8 +899,10 @@ class ServerProcess(object):
             _stop_process(self._process, 'Server process')
         else:
             msg += 'Server not started.\n'
+        if self.live_docs is not None:
+            self.live_docs.stop()
         if msg:
-            print(msg, end='')
+            _print(msg, end='')
 
     def running(self):
         """If the server has been started, is it still running?"""
@@ -216,8 +916,86 @@ class ServerProcess(object):
             msg += 'server poll: {}\n'.format(self._process.poll())
         msg += 'server running: {}\n'.format(self.running())
         msg += 'server port: {}\n'.format(self._port)
+        msg += 'server idle timeout: {}\n'.format(self._idle_timeout)
+        msg += 'server max rss: {}\n'.format(self._max_rss)
+        msg += 'server archive: {}\n'.format(self._archive)
+        msg += 'server zygote: {}\n'.format(self._zygote)
         msg += 'server root url: {}\n'.format(self.url())
-        print(msg, end='')
+        stats = self.stats()
+        if stats:
+            rss = stats['rss']
+            if rss is not None:
+                rss = '{:.1f} MB'.format(rss / 1024.0 / 1024.0)
+            msg += 'server rss: {}\n'.format(rss)
+            msg += 'server modules: {}\n'.format(stats['modules'])
+            msg += 'server recycles: {}\n'.format(stats['recycles'])
+        _print(msg, end='')
+
+    def stats(self):
+        """Return statistics reported by the running server, or None."""
+        if not self.running():
+            return None
+        try:
+            response = urlopen(self.url() + STATS_PATH[1:], timeout=1.0)
+            return json.loads(response.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def json(self, page_name, offset=0, timeout=10.0):
+        """Return the JSON description of the object documented by
+        page_name, starting the member list at offset, or None if the
+        server has no such page.
+
+        Waits up to timeout seconds for a server that is starting.
+        """
+        url = '{}{}{}?offset={}'.format(self.url(), JSON_PATH[1:],
+                                        quote(page_name), offset)
+        try:
+            response = self._open(url, timeout)
+        except HTTPError as e:
+            if e.code == 404:
+                return None
+            raise UsageError('JSON request failed: {}'.format(e))
+        except (IOError, OSError) as e:
+            raise UsageError('JSON request failed: {}'.format(e))
+        return json.loads(response.read().decode('utf-8'))
+
+    def profile_page(self, page_name, timeout=10.0):
+        """Request the page for page_name with the server profiling it.
+
+        Returns the server's breakdown of its time, as a dict of
+        milliseconds, and its profile statistics, in the form kept by
+        pstats.Stats, or None if they are not available.
+        """
+        token = '{}-{:x}'.format(os.getpid(), int(time.time() * 1e6))
+        request = Request(self.url() + quote(page_name) + '.html',
+                          headers={PROFILE_HEADER: token})
+        try:
+            response = self._open(request, timeout)
+            response.read()
+        except (IOError, OSError) as e:
+            raise UsageError('Page request failed: {}'.format(e))
+        timing = _parse_server_timing(response.info().get('Server-Timing', ''))
+        try:
+            url = self.url() + PROFILE_PATH[1:] + token
+            profile = marshal.loads(urlopen(url, timeout=timeout).read())
+        except (IOError, OSError, ValueError, EOFError, TypeError):
+            profile = None
+        return timing, profile
+
+    def _open(self, url, timeout):
+        """urlopen(url), retrying for up to timeout seconds while the
+        server is starting."""
+        deadline = time.time() + timeout
+        while True:
+            try:
+                return urlopen(url, timeout=timeout)
+            except HTTPError:
+                raise
+            except (IOError, OSError):
+                if time.time() > deadline or not self.running():
+                    raise
+                time.sleep(0.1)
 
     def url(self):
         """Base url. Includes protocol, host, and port number."""
@@ -236,7 +1014,425 @@ class ServerProcess(object):
         if not self.running():
             self._port = port
         else:
-            print('Server already running. Port number not changed')
+            _print('Server already running. Port number not changed')
+
+    @property
+    def idle_timeout(self):
+        """Seconds without requests after which the server stops itself.
+
+        The default of 0 means the server runs until it is stopped.
+        """
+        return self._idle_timeout
+
+    @idle_timeout.setter
+    def idle_timeout(self, seconds):
+        """Set idle timeout if server is not running."""
+        if not self.running():
+            self._idle_timeout = seconds
+        else:
+            _print('Server already running. Idle timeout not changed')
+
+    @property
+    def max_rss(self):
+        """Resident set size, in megabytes, at which the server process
+        is replaced by a fresh one.  The default of 0 means never.
+        """
+        return self._max_rss
+
+    @max_rss.setter
+    def max_rss(self, megabytes):
+        """Set maximum resident set size if server is not running."""
+        if not self.running():
+            self._max_rss = megabytes
+        else:
+            _print('Server already running. Maximum RSS not changed')
+
+    @property
+    def archive(self):
+        """Path of the archive of prebuilt pages the server uses, or
+        None to render every page with pydoc."""
+        return self._archive
+
+    @archive.setter
+    def archive(self, path):
+        """Set archive path if server is not running."""
+        if self.running():
+            _print('Server already running. Archive not changed')
+        elif path and not os.path.isfile(path):
+            _print('Archive not found: {}'.format(path))
+        else:
+            self._archive = os.path.abspath(path) if path else None
+
+    @property
+    def zygote(self):
+        """Zygote used to start the server, or None to start the
+        server in a new Python process."""
+        return self._zygote
+
+    @zygote.setter
+    def zygote(self, preload):
+        """Start a zygote that imports the modules in preload, or stop
+        using a zygote if preload is None."""
+        if self.running():
+            _print('Server already running. Zygote not changed')
+            return
+        if preload is not None and not hasattr(os, 'fork'):
+            _print('Zygote not available: os.fork is not supported')
+            return
+        if self._zygote is not None:
+            self._zygote.stop()
+        self._zygote = None
+        if preload is not None:
+            self._zygote = Zygote(preload)
+            self._zygote.start()
+
+
+class Zygote(object):
+    """Wrapper for a zygote process, which has the server's modules
+    imported and forks ready server processes on request.  See zygote().
+    """
+
+    def __init__(self, preload=()):
+        self.preload = list(preload)
+        self.preload_errors = {}
+        self._process = None
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        state = 'running' if self.running() else 'stopped'
+        if self.preload:
+            state += ' (preload: {})'.format(', '.join(self.preload))
+        if self.preload_errors:
+            state += ' (not imported: {})'.format(
+                ', '.join(sorted(self.preload_errors)))
+        return state
+
+    def start(self):
+        """Start the zygote process.  It imports the preloaded modules
+        in the background."""
+        path = repr(os.path.dirname(os.path.realpath(__file__)))
+        lines = ('import sys\n'
+                 'sys.path.append({path})\n'
+                 'import newtabmagic\n'
+                 'newtabmagic.zygote({preload!r})')
+        code = lines.format(path=path, preload=self.preload)
+        self.preload_errors = {}
+        self._process = subprocess.Popen(
+            [sys.executable, '-c', code],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def running(self):
+        """Is the zygote process running?"""
+        return self._process is not None and self._process.poll() is None
+
+    def fork_server(self, port, **options):
+        """Fork a server listening on port; return a ForkedServer.
+
+        Raises OSError or ValueError if the server could not be started.
+        """
+        if not self.running():
+            self.start()
+        reply = self._request({'port': port, 'options': options})
+        errors = reply.get('preload_errors', {})
+        for name in sorted(set(errors) - set(self.preload_errors)):
+            _print('Zygote could not import {}: {}'.format(
+                name, errors[name]))
+        self.preload_errors = errors
+        if 'error' in reply:
+            raise OSError(reply['error'])
+        return ForkedServer(self, reply['pid'])
+
+    def signal_server(self, pid, signum=0):
+        """Send signum to the server pid forked by the zygote, if it is
+        still running; 0 sends no signal.  Return the server's
+        returncode, None while it is running.
+
+        Servers of a zygote that has stopped have been stopped too.
+        """
+        if self.running():
+            try:
+                return self._request({'pid': pid, 'signal': signum})[
+                    'returncode']
+            except (IOError, OSError, ValueError):
+                pass
+        return -signal.SIGTERM
+
+    def _request(self, request):
+        """Send a request to the zygote process; return its reply.
+
+        Raises IOError or OSError if the zygote has gone, and ValueError
+        if its reply cannot be read.
+        """
+        with self._lock:
+            line = json.dumps(request) + '\n'
+            self._process.stdin.write(line.encode('utf-8'))
+            self._process.stdin.flush()
+            try:
+                return json.loads(
+                    self._process.stdout.readline().decode('utf-8'))
+            except ValueError:
+                # Replies can no longer be matched with requests.
+                self.stop()
+                raise
+
+    def stop(self):
+        """Stop the zygote, which stops the servers it started."""
+        if self.running():
+            self._process.stdin.close()
+            self._process.wait()
+
+
+class ForkedServer(object):
+    """Server process forked by a zygote.  Provides the methods of
+    subprocess.Popen used by ServerProcess.
+
+    The zygote reaps the process, and is asked for its state, so that a
+    process that has exited is never signalled: its pid may have been
+    reused.
+    """
+
+    def __init__(self, zygote, pid):
+        self.pid = pid
+        self.returncode = None
+        self._zygote = zygote
+
+    def poll(self):
+        """Return returncode, checking whether the process exited."""
+        return self._signal(0)
+
+    def terminate(self):
+        """Send SIGTERM."""
+        self._signal(signal.SIGTERM)
+
+    def kill(self):
+        """Send SIGKILL."""
+        self._signal(signal.SIGKILL)
+
+    def _signal(self, signum):
+        """Have the zygote send signum if the process is running;
+        return returncode."""
+        if self.returncode is None:
+            self.returncode = self._zygote.signal_server(self.pid, signum)
+        return self.returncode
+
+
+class LiveDocs(object):
+    """Render pydoc pages for objects in the kernel, such as classes
+    defined in __main__, which the server process cannot import.
+
+    Objects are registered under their page names, by the kernel only.
+    A small HTTP server, run in a thread of the kernel once objects are
+    registered, sends their pages to the pydoc server, which asks for
+    pages of objects it cannot import.  Rendered pages are cached until
+    a different object is registered under the same name.
+    """
+
+    def __init__(self):
+        self._objects = {}
+        self._pages = {}
+        self._docs = {}
+        self._lock = threading.Lock()
+        self._port = 0
+        self._server = None
+
+    def register(self, page_name, obj):
+        """Register obj as the object documented by page_name."""
+        with self._lock:
+            if self._objects.get(page_name) is not obj:
+                self._objects[page_name] = obj
+                self._pages.pop(page_name, None)
+                self._docs.pop(page_name, None)
+
+    def refresh(self, user_ns):
+        """Register the classes and functions now named in user_ns by
+        the top-level names of registered __main__ pages, so that the
+        pages of redefined objects are rendered again."""
+        prefix = '__main__.'
+        with self._lock:
+            page_names = list(self._objects)
+        for page_name in page_names:
+            name = page_name[len(prefix):]
+            if not page_name.startswith(prefix) or '.' in name:
+                continue
+            obj = user_ns.get(name)
+            if (inspect.isclass(obj) or inspect.isroutine(obj)) and \
+                    _get_object_pydoc_page_name(obj) == page_name:
+                self.register(page_name, obj)
+
+    def page(self, page_name):
+        """Return the HTML page for page_name, or None if no object is
+        registered under that name."""
+        with self._lock:
+            obj = self._objects.get(page_name)
+            if obj is None:
+                return None
+            page = self._pages.get(page_name)
+            if page is None:
+                content = pydoc.html.document(obj, page_name)
+                page = _html_page(pydoc.describe(obj), content)
+                self._pages[page_name] = page
+            return page
+
+    def json(self, page_name):
+        """Return doc_json() for page_name, or None if no object is
+        registered under that name."""
+        with self._lock:
+            obj = self._objects.get(page_name)
+            if obj is None:
+                return None
+            doc = self._docs.get(page_name)
+            if doc is None:
+                doc = doc_json(obj, page_name)
+                self._docs[page_name] = doc
+            return doc
+
+    def start(self):
+        """Start the HTTP server if objects are registered and it is not
+        running; return its url."""
+        url = self.url()
+        with self._lock:
+            registered = bool(self._objects)
+        if self._server is None and registered:
+            try:
+                self._server = HTTPServer(('127.0.0.1', self._port),
+                                          _LiveDocsHandler)
+            except (IOError, OSError) as e:
+                _print('Could not serve live objects: {}'.format(e))
+                return url
+            self._server.live_docs = self
+            thread = threading.Thread(target=self._server.serve_forever)
+            thread.daemon = True
+            thread.start()
+        return url
+
+    def stop(self):
+        """Stop the HTTP server if it is running."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def running(self):
+        """Is the HTTP server running?"""
+        return self._server is not None
+
+    def url(self):
+        """Base url of the HTTP server.  Its port is chosen the first
+        time, so that the url can be given to the pydoc server before
+        the HTTP server is started."""
+        if self._port == 0:
+            self._port = _port_not_in_use()
+        return 'http://127.0.0.1:{}/'.format(self._port)
+
+
+class _LiveDocsHandler(BaseHTTPRequestHandler):
+    """Request handler for the LiveDocs server."""
+
+    def do_GET(self):  # pylint: disable=C0103
+        """Send the page, or JSON description, of a registered object."""
+        page = None
+        content_type = 'text/html'
+        live_docs = self.server.live_docs
+        if self.path.startswith(JSON_PATH):
+            doc = live_docs.json(self.path[len(JSON_PATH):])
+            if doc is not None:
+                page = json.dumps(doc)
+                content_type = 'application/json'
+        elif self.path.endswith('.html'):
+            page = live_docs.page(self.path[1:-len('.html')])
+        if page is None:
+            self.send_error(404)
+            return
+        body = page.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type + '; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        # Don't log messages.
+        pass
+
+
+def _live_object(obj, page_name):
+    """Return the object documented by page_name if the pydoc server
+    cannot import it, or None."""
+    if not page_name.startswith('__main__.'):
+        return None
+    if inspect.isclass(obj) or inspect.isroutine(obj) or \
+            isinstance(obj, property):
+        return obj
+    return type(obj)
+
+
+# Functions timed within the name lookup stage of %newtab --profile:
+# (label, file name, function name).
+LOOKUP_FUNCTIONS = (
+    ('user namespace', 'newtabmagic.py', '_get_user_ns_object'),
+    ('fullqualname', 'fullqualname.py', 'fullqualname'),
+    ('pydoc.locate', 'pydoc.py', 'locate'),
+)
+
+
+class _ProfileData(object):
+    """Profile statistics received from the server, in the form that
+    pstats.Stats loads from a profiler."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        """The statistics are already created."""
+        pass
+
+
+def _function_times(stats, functions):
+    """Return [(label, seconds)], the cumulative time of each function
+    in stats named in functions, a sequence of (label, file name,
+    function name)."""
+    times = []
+    for label, filename, funcname in functions:
+        seconds = 0.0
+        for (path, _, name), row in stats.stats.items():
+            if name == funcname and os.path.basename(path) == filename:
+                seconds += row[3]
+        times.append((label, seconds))
+    return times
+
+
+def format_profile(stages, lookup, timing):
+    """Format the stage times of %newtab --profile as text.
+
+    stages and lookup are lists of (stage, seconds); timing is the
+    server's breakdown of its page time, in milliseconds, or None.
+    """
+    lines = []
+    for stage, seconds in stages:
+        lines.append('{}: {:.1f} ms'.format(stage, 1000 * seconds))
+        if stage == 'name lookup':
+            for label, sub in lookup:
+                lines.append('  {}: {:.1f} ms'.format(label, 1000 * sub))
+        elif stage == 'server page' and timing:
+            for label, ms in sorted(timing.items()):
+                lines.append('  server {}: {:.1f} ms'.format(label, ms))
+    total = sum(seconds for _, seconds in stages)
+    lines.append('total: {:.1f} ms'.format(1000 * total))
+    return '\n'.join(lines)
+
+
+def _parse_server_timing(header):
+    """Parse a Server-Timing header into a dict of milliseconds."""
+    timing = {}
+    for metric in header.split(','):
+        parts = [part.strip() for part in metric.split(';')]
+        for part in parts[1:]:
+            if part.startswith('dur='):
+                try:
+                    timing[parts[0]] = float(part[len('dur='):])
+                except ValueError:
+                    pass
+    return timing
 
 
 def _get_object_pydoc_page_name(obj):
@@ -282,41 +1478,1349 @@ def _getattr(obj, attr):
     return f(obj)
 
 
-def _stop_process(p, name):
-    """Stop process, by applying terminate and kill."""
+def _stop_process(p, name, grace=1.0):
+    """Stop process, by applying terminate and, if it has not exited
+    within grace seconds, kill."""
     # Based on code in IPython.core.magics.script.ScriptMagics.shebang
     if p.poll() is not None:
-        print("{} is already stopped.".format(name))
+        _print("{} is already stopped.".format(name))
         return
     p.terminate()
-    time.sleep(0.1)
+    deadline = time.time() + grace
+    while p.poll() is None and time.time() < deadline:
+        time.sleep(0.02)
     if p.poll() is not None:
-        print("{} is terminated.".format(name))
+        _print("{} is terminated.".format(name))
         return
     p.kill()
-    print("{} is killed.".format(name))
+    _print("{} is killed.".format(name))
+
+
+STATS_PATH = '/__newtab_stats'
+INDEX_PATHS = ('/', '/index.html')
+# Pages of pydoc's url handler that take a query, counted as routes.
+QUERY_ROUTES = ('search', 'get')
+JSON_PATH = '/__newtab_json/'
+JSON_LIMIT = 100
+PROFILE_PATH = '/__newtab_profile/'
+PROFILE_HEADER = 'X-Newtab-Profile'
+SOURCE_PATH = '/__newtab_source/'
+# Lines in a source view, and lines shown before an object's definition.
+SOURCE_LINES = 500
+SOURCE_CONTEXT = 5
+
+
+class DocHandler(BaseHTTPRequestHandler):
+    """Request handler for the documentation server.
+
+    Connections are persistent (HTTP/1.1), every response having a
+    Content-Length.  A connection is closed after it has been idle for
+    the server's keep_alive_timeout, or once the server is quitting.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        self.timeout = self.server.keep_alive_timeout
+        BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):  # pylint: disable=C0103
+        """Send the pydoc page named by the request path.
+
+        A request with a PROFILE_HEADER is profiled.  The response has a
+        Server-Timing header, and the profile is kept for a request to
+        PROFILE_PATH followed by the header's value.
+        """
+        route = _route(self.path)
+        self._sent = 0
+        self._import_time = 0.0
+        self._profiler = None
+        self._start = start = self.server.metrics.request_started()
+        try:
+            if self.headers.get(PROFILE_HEADER):
+                self._profiler = cProfile.Profile()
+                self._profiler.enable()
+            self._get(route)
+        finally:
+            if self._profiler is not None:
+                self._profiler.disable()
+            self.server.metrics.request_finished(
+                route, time.time() - start, self._sent, self._import_time)
+
+    def _get(self, route):
+        """Send the response for a GET request."""
+        if route == 'stats':
+            body = json.dumps(self.server.stats())
+            self._send(body, 'application/json')
+            return
+        self.server.last_request = time.time()
+        if route == 'json':
+            self._get_json()
+            return
+        if route == 'source':
+            self._get_source()
+            return
+        if route == 'profile':
+            profile = self.server.pop_profile(self.path[len(PROFILE_PATH):])
+            if profile is None:
+                error = {'error': 'No such profile'}
+                self._send(json.dumps(error), 'application/json', 404)
+            else:
+                self._send_chunks([profile], 'application/octet-stream')
+            return
+        if route == 'css':
+            content_type = 'text/css'
+        else:
+            content_type = 'text/html'
+        if route == 'index':
+            # Kept up to date by ModuleIndex, unlike an archived index.
+            self._send(self.server.module_index.page(), content_type)
+            return
+        if self.server.archive is not None:
+            gzip = _accepts_gzip(self.headers.get('Accept-Encoding', ''))
+            page = self.server.archive.page(self.path, gzip)
+            if page is not None:
+                chunks, encoding = page
+                self._send_chunks(chunks, content_type, encoding)
+                return
+        text = None
+        if route == 'page':
+            # Import the object first, so that rendering time can be
+            # told apart from import time.
+            name = self.path[1:-len('.html')]
+            start = time.time()
+            try:
+                obj = pydoc.locate(name)
+            except pydoc.ErrorDuringImport:
+                obj = None
+            self._import_time = time.time() - start
+            # Objects this process cannot import may live in the kernel.
+            if self.server.live_url and \
+                    (obj is None or name.startswith('__main__.')):
+                text = _fetch_live_page(self.server.live_url, self.path)
+        if text is None:
+            text = _render_page(self.path, content_type)
+        self._send(text, content_type)
+
+    def _get_json(self):
+        """Send the JSON description of the object named by the path.
+
+        The query gives the offset and limit of the members sent.
+        """
+        path, _, query = self.path.partition('?')
+        name = path[len(JSON_PATH):]
+        params = parse_qs(query)
+        try:
+            offset = int(params.get('offset', [0])[0])
+            limit = int(params.get('limit', [JSON_LIMIT])[0])
+        except ValueError:
+            error = {'error': 'offset and limit must be integers'}
+            self._send(json.dumps(error), 'application/json', 400)
+            return
+        doc = None
+        if not name.startswith('__main__.'):
+            doc = self.server.json_docs.get(name)
+        if doc is None and self.server.live_url:
+            text = _fetch_live_page(self.server.live_url, self.path)
+            if text is not None:
+                doc = json.loads(text)
+        if doc is None:
+            error = {'error': 'Documentation not found: {}'.format(name)}
+            self._send(json.dumps(error), 'application/json', 404)
+            return
+        self._send(json.dumps(_json_members_page(doc, offset, limit)),
+                   'application/json')
+
+    def _get_source(self):
+        """Send a view of the source file of the object named by the path.
+
+        With raw in the query, the file is sent as text, honouring a
+        Range header.  Otherwise count lines from line start are sent
+        as HTML; by default the view starts just before the object's
+        definition.
+        """
+        path, _, query = self.path.partition('?')
+        name = path[len(SOURCE_PATH):]
+        params = parse_qs(query, keep_blank_values=True)
+        found = self.server.sources.get(name)
+        if found is None:
+            text = _html_page('Source not found',
+                              'No source code found for {}'.format(
+                                  pydoc.html.escape(name)))
+            self._send(text, 'text/html', 404)
+            return
+        source, line = found
+        if 'raw' in params:
+            self._send_raw(source)
+            return
+        try:
+            start = int(params.get('start', [line - SOURCE_CONTEXT])[0])
+            count = int(params.get('count', [SOURCE_LINES])[0])
+        except ValueError:
+            text = _html_page('Bad request',
+                              'start and count must be integers')
+            self._send(text, 'text/html', 400)
+            return
+        self._send(_source_page(name, source, start, count, line),
+                   'text/html')
+
+    def _send_raw(self, source):
+        """Send a source file, or the byte range of it asked for, as
+        text straight from the memory map."""
+        size = len(source.data)
+        headers = [('Accept-Ranges', 'bytes')]
+        try:
+            byte_range = _parse_range(self.headers.get('Range'), size)
+        except ValueError:
+            headers.append(('Content-Range', 'bytes */{}'.format(size)))
+            self._send_chunks([b''], 'text/plain', status=416,
+                              headers=headers)
+            return
+        if byte_range is None:
+            self._send_chunks([memoryview(source.data)], 'text/plain',
+                              headers=headers)
+            return
+        first, last = byte_range
+        headers.append(('Content-Range',
+                        'bytes {}-{}/{}'.format(first, last, size)))
+        self._send_chunks([memoryview(source.data)[first:last + 1]],
+                          'text/plain', status=206, headers=headers)
+
+    def _send(self, text, content_type, status=200):
+        """Send text as a complete response."""
+        self._send_chunks([text.encode('utf-8')], content_type,
+                          status=status)
+
+    def _send_chunks(self, chunks, content_type, encoding=None, status=200,
+                     headers=()):
+        """Send a response whose body is the concatenation of chunks,
+        which may be buffers such as memoryviews."""
+        length = sum(len(c) for c in chunks)
+        timing = self._finish_profile()
+        self.send_response(status)
+        for header, value in headers:
+            self.send_header(header, value)
+        if timing is not None:
+            self.send_header('Server-Timing', timing)
+        self.send_header('Content-Type', '%s; charset=UTF-8' % content_type)
+        self.send_header('Content-Length', str(length))
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Vary', 'Accept-Encoding')
+        if self.server.quit:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(chunk)
+        self._sent += length
+
+    def _finish_profile(self):
+        """Stop profiling the request, if it is profiled, and keep the
+        profile.  Returns the value of its Server-Timing header."""
+        if self._profiler is None:
+            return None
+        self._profiler.disable()
+        self._profiler.create_stats()
+        self.server.save_profile(self.headers.get(PROFILE_HEADER),
+                                 marshal.dumps(self._profiler.stats))
+        self._profiler = None
+        render = time.time() - self._start - self._import_time
+        timing = 'import;dur={:.3f}, render;dur={:.3f}'
+        return timing.format(1000 * self._import_time, 1000 * render)
+
+    def log_message(self, *args):
+        # Don't log messages.
+        pass
+
+
+def _route(path):
+    """Name used in server statistics for the kind of page at path."""
+    if path == STATS_PATH:
+        return 'stats'
+    elif path.startswith(JSON_PATH):
+        return 'json'
+    elif path.startswith(PROFILE_PATH):
+        return 'profile'
+    elif path.startswith(SOURCE_PATH):
+        return 'source'
+    elif path in INDEX_PATHS:
+        return 'index'
+    elif path.endswith('.css'):
+        return 'css'
+    elif path in ('/topics.html', '/keywords.html') or \
+            path.startswith('/topic?'):
+        return 'topics'
+    elif '?' in path:
+        # Only pydoc's own queries get routes, to keep the set bounded.
+        route = path[1:path.index('?')]
+        return route if route in QUERY_ROUTES else 'other'
+    elif path.endswith('.html'):
+        return 'page'
+    return 'other'
+
+
+class ServerStats(object):
+    """Request counts, latency histograms and byte counts kept by the
+    documentation server.
+
+    A request is recorded once its response has been written, so its
+    latency includes sending the body, and a client that has just read
+    a response may not find it counted yet.
+    """
+
+    # Upper bounds, in milliseconds, of the latency histogram buckets.
+    # The last bucket counts slower requests.
+    BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.in_flight = 0
+        self.bytes_sent = 0
+        self.import_time = 0.0
+        self.render_time = 0.0
+        self.routes = {}
+
+    def request_started(self):
+        """Count a request in flight and return its start time."""
+        with self._lock:
+            self.in_flight += 1
+        return time.time()
+
+    def request_finished(self, route, seconds, sent, import_time=0.0):
+        """Record a finished request."""
+        with self._lock:
+            self.in_flight -= 1
+            self.bytes_sent += sent
+            if route == 'page':
+                self.import_time += import_time
+                self.render_time += seconds - import_time
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = {'count': 0, 'time': 0.0, 'max_time': 0.0,
+                         'histogram': [0] * (len(self.BUCKETS) + 1)}
+                self.routes[route] = stats
+            stats['count'] += 1
+            stats['time'] += seconds
+            stats['max_time'] = max(stats['max_time'], seconds)
+            ms = seconds * 1000
+            bucket = len([b for b in self.BUCKETS if b < ms])
+            stats['histogram'][bucket] += 1
+
+    def as_dict(self):
+        """Return the statistics as a dict that can be sent as JSON."""
+        with self._lock:
+            routes = dict((route, dict(stats, histogram=list(
+                stats['histogram']))) for route, stats in self.routes.items())
+            return {
+                'uptime': time.time() - self.started,
+                'requests': sum(r['count'] for r in routes.values()),
+                'in_flight': self.in_flight,
+                'bytes_sent': self.bytes_sent,
+                'import_time': self.import_time,
+                'render_time': self.render_time,
+                'buckets': list(self.BUCKETS),
+                'routes': routes,
+            }
+
+
+def _percentile(histogram, buckets, fraction):
+    """Upper bound in milliseconds of the histogram bucket holding the
+    given fraction of requests, or None for the overflow bucket."""
+    target = fraction * sum(histogram)
+    count = 0
+    for bound, n in zip(list(buckets) + [None], histogram):
+        count += n
+        if n and count >= target:
+            return bound
+    return None
+
+
+def format_stats(stats):
+    """Format statistics returned by the server's stats page."""
+    lines = []
+    rss = stats['rss']
+    if rss is not None:
+        rss = '{:.1f} MB'.format(rss / 1024.0 / 1024.0)
+    lines.append('pid: {}  rss: {}  modules: {}  recycles: {}'.format(
+        stats['pid'], rss, stats['modules'], stats['recycles']))
+    lines.append('requests: {}  in flight: {}  sent: {} bytes'.format(
+        stats['requests'], stats['in_flight'], stats['bytes_sent']))
+    lines.append('page time: {:.3f}s importing, {:.3f}s rendering'.format(
+        stats['import_time'], stats['render_time']))
+    for name, cache in sorted(stats['caches'].items()):
+        total = cache['hits'] + cache['misses']
+        rate = 100.0 * cache['hits'] / total if total else 0.0
+        lines.append('{} cache: {} hits, {} misses ({:.0f}%)'.format(
+            name, cache['hits'], cache['misses'], rate))
+    lines.append('{:<8}{:>8}{:>10}{:>10}{:>10}{:>10}'.format(
+        'route', 'count', 'mean ms', 'p50 ms', 'p95 ms', 'max ms'))
+    for route, r in sorted(stats['routes'].items()):
+        percentiles = []
+        for fraction in (0.5, 0.95):
+            bound = _percentile(r['histogram'], stats['buckets'], fraction)
+            percentiles.append('<=' + str(bound) if bound else 'slow')
+        lines.append('{:<8}{:>8}{:>10.1f}{:>10}{:>10}{:>10.1f}'.format(
+            route, r['count'], 1000.0 * r['time'] / r['count'],
+            percentiles[0], percentiles[1], 1000.0 * r['max_time']))
+    return '\n'.join(lines)
+
+
+def _fetch_live_page(live_url, path):
+    """Get a page from the kernel's LiveDocs server, or None if it does
+    not have the page."""
+    path = path.partition('?')[0]
+    try:
+        return urlopen(live_url + path[1:], timeout=10).read().decode('utf-8')
+    except (IOError, OSError):
+        return None
+
+
+def _render_page(path, content_type):
+    """Render the pydoc page at path, linking the source file named on
+    a module page to the server's view of it."""
+    text = pydoc._url_handler(path, content_type)
+    if path.endswith('.html'):
+        link = '<a href="{}{}">'.format(SOURCE_PATH, path[1:-len('.html')])
+        text = re.sub(r'<a href="file:[^"]*">', lambda _: link, text,
+                      count=1)
+    return text
+
+
+class SourceFile(object):
+    """A source file mapped into memory, with an index of the offsets
+    of its lines.  Lines are decoded and HTML-escaped in blocks, when
+    first viewed, and the escaped blocks kept."""
+
+    BLOCK_LINES = 1024
+
+    def __init__(self, path):
+        self.path = path
+        stat = os.stat(path)
+        self.key = (stat.st_mtime, stat.st_size)
+        if stat.st_size:
+            with open(path, 'rb') as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b''
+        self._offsets = self._index()
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def _index(self):
+        """Offsets of the starts of lines, and of the end of the file."""
+        offsets = [0]
+        find = self.data.find
+        end = find(b'\n')
+        while end != -1:
+            offsets.append(end + 1)
+            end = find(b'\n', end + 1)
+        if offsets[-1] != len(self.data):
+            offsets.append(len(self.data))
+        return offsets
+
+    @property
+    def line_count(self):
+        """Number of lines in the file."""
+        return len(self._offsets) - 1
+
+    def lines(self, start, stop):
+        """HTML-escaped lines start to stop (0-based, stop excluded)."""
+        lines = []
+        size = self.BLOCK_LINES
+        for block in range(start // size, (stop - 1) // size + 1):
+            first = block * size
+            escaped = self._block(block)
+            lines.extend(escaped[max(start - first, 0):stop - first])
+        return lines
+
+    def _block(self, block):
+        """Escaped lines of a block."""
+        with self._lock:
+            escaped = self._blocks.get(block)
+        if escaped is None:
+            first = block * self.BLOCK_LINES
+            last = min(first + self.BLOCK_LINES, self.line_count)
+            data = self.data[self._offsets[first]:self._offsets[last]]
+            text = pydoc.html.escape(data.decode('utf-8', 'replace'))
+            escaped = [line.rstrip('\r')
+                       for line in text.split('\n')[:last - first]]
+            with self._lock:
+                self._blocks[block] = escaped
+        return escaped
+
+
+class SourceFiles(object):
+    """Cache of SourceFiles, and of the source locations of the objects
+    named by page names.  A file changed on disk is mapped again, and
+    the locations in it are looked up again; the least recently used
+    files are dropped first."""
+
+    def __init__(self, max_files=32):
+        self.max_files = max_files
+        self.hits = 0
+        self.misses = 0
+        self._files = collections.OrderedDict()
+        self._locations = {}
+        self._lock = threading.Lock()
+
+    def get(self, page_name):
+        """Return (SourceFile, line) for the object named by page_name,
+        line being the first line of its definition, or None if it has
+        no source file."""
+        location = self._locations.get(page_name)
+        if location is not None:
+            path, line, key = location
+            if _file_key(path) != key:
+                # Lines of a changed file may have moved.
+                location = None
+        if location is None:
+            location = _source_location(page_name)
+            if location is None:
+                return None
+            path, line = location
+            key = _file_key(path)
+            self._locations[page_name] = path, line, key
+        if key is None:
+            return None
+        with self._lock:
+            source = self._files.pop(path, None)
+            if source is not None and source.key == key:
+                self.hits += 1
+            else:
+                self.misses += 1
+                source = None
+        if source is None:
+            try:
+                source = SourceFile(path)
+            except (IOError, OSError, ValueError):
+                return None
+        with self._lock:
+            self._files[path] = source
+            while len(self._files) > self.max_files:
+                # A view being sent keeps its file mapped.
+                self._files.popitem(last=False)
+        return source, line
+
+
+def _file_key(path):
+    """Return (mtime, size) of the file at path, or None."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+def _source_location(page_name):
+    """Return (path, line) of the source file of the object named by
+    page_name and the first line of its definition, or None."""
+    try:
+        obj = pydoc.locate(page_name)
+    except pydoc.ErrorDuringImport:
+        return None
+    if obj is None:
+        return None
+    try:
+        path = inspect.getsourcefile(obj)
+    except TypeError:
+        return None
+    if not path or not os.path.isfile(path):
+        return None
+    line = 1
+    if not inspect.ismodule(obj):
+        try:
+            line = inspect.findsource(obj)[1] + 1
+        except (IOError, OSError, TypeError, IndexError):
+            pass
+    return os.path.abspath(path), line
+
+
+def _source_page(name, source, start, count, line):
+    """HTML view of count lines of source from line start (1-based).
+    line, the first line of the object's definition, is highlighted."""
+    total = source.line_count
+    start = min(max(start, 1), max(total, 1))
+    stop = min(start + max(count, 1), total + 1)
+    rows = []
+    for number, text in enumerate(source.lines(start - 1, stop - 1), start):
+        row = '<span id="L{0}">{0:>6}</span>  {1}'.format(number, text)
+        if number == line:
+            row = '<strong>{}</strong>'.format(row)
+        rows.append(row)
+    url = '{}{}'.format(SOURCE_PATH, name)
+    links = []
+    if start > 1:
+        links.append('<a href="{}?start={}&count={}">previous</a>'.format(
+            url, max(start - count, 1), count))
+    if stop <= total:
+        links.append('<a href="{}?start={}&count={}">next</a>'.format(
+            url, stop, count))
+    links.append('<a href="{}?raw">raw</a>'.format(url))
+    nav = '<p>{} lines {}-{} of {} : {}</p>\n'.format(
+        pydoc.html.escape(source.path), start, stop - 1, total,
+        ' : '.join(links))
+    contents = '{}<pre>{}</pre>\n{}'.format(nav, '\n'.join(rows), nav)
+    return _html_page('source of ' + pydoc.html.escape(name), contents)
+
+
+def _parse_range(header, size):
+    """Return the (first, last) byte positions of a Range header of a
+    single byte range, or None to send the whole body.  Raises
+    ValueError if the range cannot be satisfied."""
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, sep, last = header[len('bytes='):].strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if first:
+            first = int(first)
+            last = int(last) if last else size - 1
+        else:
+            first = max(size - int(last), 0)
+            last = size - 1
+    except ValueError:
+        return None
+    if first >= size or first > last:
+        raise ValueError('unsatisfiable range: {}'.format(header))
+    return first, min(last, size - 1)
+
 
+class JsonDocs(object):
+    """Cache of doc_json() descriptions of the objects named by page
+    names.  The least recently used are dropped first."""
 
-def pydoc_cli_monkey_patched(port):
-    """In Python 3, run pydoc.cli with builtins.input monkey-patched
-    so that pydoc can be run as a process.
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._docs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, page_name):
+        """Return the description of the object named by page_name, or
+        None if it cannot be located."""
+        with self._lock:
+            doc = self._docs.pop(page_name, None)
+            if doc is not None:
+                self._docs[page_name] = doc
+                self.hits += 1
+                return doc
+            self.misses += 1
+        try:
+            obj = pydoc.locate(page_name)
+        except pydoc.ErrorDuringImport:
+            obj = None
+        if obj is None:
+            return None
+        doc = doc_json(obj, page_name)
+        with self._lock:
+            self._docs[page_name] = doc
+            while len(self._docs) > self.max_entries:
+                self._docs.popitem(last=False)
+        return doc
+
+
+def doc_json(obj, page_name):
+    """Describe the object documented by page_name as a dict that can be
+    sent as JSON.
+
+    members lists the attributes shown on its pydoc page, each with its
+    kind, page name and the first line of its docstring.
+    """
+    doc = {
+        'name': page_name,
+        'kind': _kind(obj),
+        'description': pydoc.describe(obj),
+        'signature': _signature(obj),
+        'doc': inspect.getdoc(obj),
+        'file': None,
+        'line': None,
+    }
+    try:
+        doc['file'] = inspect.getsourcefile(obj)
+        doc['line'] = max(inspect.getsourcelines(obj)[1], 1)
+    except (TypeError, IOError, OSError):
+        pass
+    members = []
+    if inspect.ismodule(obj) or inspect.isclass(obj):
+        try:
+            items = _page_members(obj)
+        except Exception:  # pylint: disable=W0703
+            items = []
+        for name, value in items:
+            kind = _kind(value)
+            summary = None
+            if kind != 'data':
+                summary = (inspect.getdoc(value) or '').split('\n')[0]
+            members.append({'name': name, 'kind': kind,
+                            'page': page_name + '.' + name,
+                            'summary': summary})
+    doc['members'] = members
+    return doc
+
+
+def _page_members(obj):
+    """Return the (name, value) pairs of the attributes of a module or
+    class that its pydoc page shows, as pydoc.HTMLDoc selects them:
+    attributes inherited from object are left out of classes, and the
+    classes and functions of a module without __all__ are those it
+    defines."""
+    if inspect.isclass(obj):
+        return sorted(
+            (attr.name, getattr(obj, attr.name, attr.object))
+            for attr in inspect.classify_class_attrs(obj)
+            if pydoc.visiblename(attr.name, obj=obj) and
+            (attr.defining_class is not object or obj is object))
+    all_names = getattr(obj, '__all__', None)
+    members = []
+    for name, value in inspect.getmembers(obj):
+        if not pydoc.visiblename(name, all_names, obj):
+            continue
+        if all_names is None:
+            if inspect.ismodule(value):
+                if not value.__name__.startswith(obj.__name__ + '.'):
+                    continue
+            elif inspect.isclass(value) or inspect.isroutine(value):
+                if not inspect.isbuiltin(value) and \
+                        (inspect.getmodule(value) or obj) is not obj:
+                    continue
+        members.append((name, value))
+    return members
+
+
+def _kind(obj):
+    """Kind of object, as reported by doc_json()."""
+    if inspect.ismodule(obj):
+        return 'module'
+    elif inspect.isclass(obj):
+        return 'class'
+    elif inspect.isroutine(obj):
+        return 'function'
+    elif inspect.isdatadescriptor(obj):
+        return 'property'
+    return 'data'
+
+
+def _signature(obj):
+    """Signature of a callable object as a string, or None."""
+    if not callable(obj):
+        return None
+    try:
+        return str(inspect.signature(obj))
+    except AttributeError:
+        # Python 2
+        try:
+            return inspect.formatargspec(*inspect.getargspec(obj))
+        except TypeError:
+            return None
+    except (TypeError, ValueError):
+        return None
+
+
+def _json_members_page(doc, offset, limit):
+    """Copy of doc listing limit members starting at offset.
+
+    next_offset is the offset of the following members, or None.
+    """
+    members = doc['members']
+    offset = max(offset, 0)
+    limit = max(limit, 0)
+    end = offset + limit
+    page = dict(doc, members=members[offset:end])
+    page.update({
+        'members_total': len(members),
+        'offset': offset,
+        'limit': limit,
+        'next_offset': end if end < len(members) else None,
+    })
+    return page
+
+
+def _accepts_gzip(accept_encoding):
+    """Does an Accept-Encoding header value allow gzip?"""
+    for coding in accept_encoding.split(','):
+        params = [p.strip() for p in coding.split(';')]
+        if params[0].lower() == 'gzip':
+            return 'q=0' not in params and 'q=0.0' not in params
+    return False
+
+
+class DocArchive(object):
+    """Read-only zip archive of rendered pydoc pages.
+
+    Entries are named by request path without the leading slash, with
+    index.html for the root page.  The archive is memory-mapped, and a
+    deflated entry is sent to a client that accepts gzip by framing
+    the compressed bytes in place with a gzip header and trailer.
+    """
+
+    _GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._zip = zipfile.ZipFile(self._file)
+        self._index = dict((info.filename, info)
+                           for info in self._zip.infolist())
+        self._offsets = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, path):
+        return self._entry_name(path) in self._index
+
+    def page(self, path, gzip=False):
+        """Return (chunks, encoding) for the page at the request path,
+        or None if the archive does not have it."""
+        info = self._index.get(self._entry_name(path))
+        if info is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if gzip and info.compress_type == zipfile.ZIP_DEFLATED:
+            start = self._data_offset(info)
+            data = memoryview(self._map)[start:start + info.compress_size]
+            trailer = struct.pack('<II', info.CRC & 0xffffffff,
+                                  info.file_size & 0xffffffff)
+            return [self._GZIP_HEADER, data, trailer], 'gzip'
+        return [self._zip.read(info)], None
+
+    def close(self):
+        """Close the archive."""
+        self._zip.close()
+        self._map.close()
+        self._file.close()
+
+    @staticmethod
+    def _entry_name(path):
+        """Archive entry name for a request path."""
+        return path.lstrip('/') or 'index.html'
+
+    def _data_offset(self, info):
+        """Offset in the archive of the entry's compressed data."""
+        offset = self._offsets.get(info.filename)
+        if offset is None:
+            header = info.header_offset
+            name_len, extra_len = struct.unpack(
+                '<HH', self._map[header + 26:header + 30])
+            offset = header + 30 + name_len + extra_len
+            self._offsets[info.filename] = offset
+        return offset
+
+
+class ModuleIndex(object):
+    """Module index page built from a cache of the top-level modules in
+    each sys.path entry.
+
+    Each request rescans only the entries whose modification time has
+    changed since they were last scanned, instead of listing every
+    directory on sys.path as pydoc's index does.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.updated = None
+        self.rescanned = 0
+        self.hits = 0
+        self.misses = 0
+
+    def refresh(self):
+        """Rescan sys.path entries that are new or have changed."""
+        with self._lock:
+            self.rescanned = 0
+            for path in sys.path:
+                mtime = _mtime(path)
+                cached = self._entries.get(path)
+                if cached is None or cached[0] != mtime:
+                    modules = sorted(
+                        (name, ispkg) for _, name, ispkg in
+                        pkgutil.iter_modules([path]))
+                    self._entries[path] = (mtime, modules)
+                    self.rescanned += 1
+            if self.rescanned or self.updated is None:
+                self.updated = time.time()
+            self.misses += self.rescanned
+            self.hits += len(sys.path) - self.rescanned
+
+    def modules(self):
+        """Return (path, [(name, ispkg, shadowed)]) for each entry of
+        sys.path, refreshing the cache first."""
+        self.refresh()
+        seen = set()
+        result = []
+        for path in sys.path:
+            modules = []
+            for name, ispkg in self._entries[path][1]:
+                modules.append((name, ispkg, name in seen))
+                seen.add(name)
+            result.append((path, modules))
+        return result
+
+    def page(self):
+        """Return the HTML module index page."""
+        html = pydoc.HTMLDoc()
+
+        def bltinlink(name):
+            """Link to a built-in module."""
+            return '<a href="%s.html">%s</a>' % (name, name)
+
+        def modlink(module):
+            """Link to a module or package in a sys.path entry."""
+            name, ispkg, shadowed = module
+            return html.modpkglink((name, '', ispkg, shadowed))
+
+        names = [name for name in sys.builtin_module_names
+                 if name != '__main__']
+        contents = ['<h1>Index of Modules</h1>',
+                    '<h2>Built-in Modules</h2>',
+                    html.multicolumn(names, bltinlink)]
+        for path, modules in self.modules():
+            if modules:
+                contents.append('<h2>%s</h2>' % html.escape(path))
+                contents.append(html.multicolumn(modules, modlink))
+        age = time.time() - self.updated
+        contents.append(
+            '<p><small>Module list updated %d seconds ago; %d of %d '
+            'sys.path entries rescanned.</small></p>'
+            % (age, self.rescanned, len(sys.path)))
+        return _html_page('Index of Modules', ''.join(contents))
+
+
+def _mtime(path):
+    """Modification time of path, or None if it does not exist."""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _html_page(title, contents):
+    """Format an HTML page with the pydoc style sheet and navigation."""
+    return (
+        '<!DOCTYPE html>\n'
+        '<html lang="en">\n<head>\n<meta charset="utf-8">\n'
+        '<title>Pydoc: %s</title>\n'
+        '<link rel="stylesheet" type="text/css" '
+        'href="/pydoc_data/_pydoc.css">\n'
+        '</head><body>\n'
+        '<div style="float:right">\n'
+        '<a href="/index.html">Module Index</a>\n'
+        ': <a href="/topics.html">Topics</a>\n'
+        ': <a href="/keywords.html">Keywords</a>\n'
+        '<form action="/get" style="display:inline;">'
+        '<input type=text name=key size=15>'
+        '<input type=submit value="Get"></form>\n'
+        '<form action="/search" style="display:inline;">'
+        '<input type=text name=key size=15>'
+        '<input type=submit value="Search"></form>\n'
+        '</div>\n'
+        '<div style="clear:both;padding-top:.5em;">%s</div>\n'
+        '</body></html>' % (title, contents))
+
+
+def build_archive(path, names):
+    """Render pydoc pages into a zip archive for DocArchive.
+
+    The archive holds the style sheet, and for each module named
+    (including the submodules of packages) the module page and pages
+    for the classes and functions it defines.  The index page is not
+    archived: the server keeps its own up to date.
+    """
+    pages = set(['/pydoc_data/_pydoc.css'])
+    for name in names:
+        pages.update('/' + page + '.html' for page in _module_pages(name))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for page in sorted(pages):
+            if page.endswith('.css'):
+                content_type = 'text/css'
+            else:
+                content_type = 'text/html'
+            text = _render_page(page, content_type)
+            archive.writestr(DocArchive._entry_name(page),
+                             text.encode('utf-8'))
+
+
+def _module_pages(name):
+    """Names of pages for a module, its submodules and their members.
+
+    Submodules that cannot be imported are skipped.
+    """
+    module = pydoc.locate(name)
+    if module is None:
+        return []
+    modules = [module]
+    if hasattr(module, '__path__'):
+        for _, subname, _ in pkgutil.walk_packages(
+                module.__path__, name + '.', onerror=lambda _: None):
+            try:
+                submodule = pydoc.locate(subname)
+            except Exception:  # pylint: disable=W0703
+                # Optional or platform-only submodules fail to import.
+                continue
+            if submodule is not None:
+                modules.append(submodule)
+    pages = []
+    for module in modules:
+        pages.append(module.__name__)
+        for attr, obj in vars(module).items():
+            if (inspect.isclass(obj) or inspect.isroutine(obj)) and \
+                    getattr(obj, '__module__', None) == module.__name__:
+                pages.append(module.__name__ + '.' + attr)
+    return pages
+
+
+class DocServer(ThreadingMixIn, HTTPServer):
+    """pydoc web server that quits after idle_timeout seconds without
+    a request.  An idle_timeout of 0 disables the timeout.
+
+    Each connection is handled in its own thread, and is kept open for
+    further requests until it has been idle for keep_alive_timeout
+    seconds.
+
+    If max_rss (bytes) is nonzero, the server asks to be recycled once
+    its resident set size exceeds max_rss.  See _serve_recycling.
+    """
+
+    # Browsers open several connections at once.
+    request_queue_size = 64
+
+    def __init__(self, port, idle_timeout=0, max_rss=0, archive=None,
+                 keep_alive_timeout=5.0, live_url=None):
+        HTTPServer.__init__(self, ('127.0.0.1', port), DocHandler)
+        self.keep_alive_timeout = keep_alive_timeout
+        self.live_url = live_url
+        self.archive = DocArchive(archive) if archive else None
+        self.module_index = ModuleIndex()
+        self.json_docs = JsonDocs()
+        self.sources = SourceFiles()
+        self.metrics = ServerStats()
+        self.idle_timeout = idle_timeout
+        self.max_rss = max_rss
+        self.last_request = time.time()
+        self.quit = False
+        self.timeout = min(1.0, idle_timeout) if idle_timeout else 1.0
+        self.recycles = 0
+        self.recycle_fd = None
+        self.supervisor_pid = None
+        self._profiles = collections.OrderedDict()
+        self._profiles_lock = threading.Lock()
+
+    def save_profile(self, token, profile):
+        """Keep the marshalled profile of a request until it is asked
+        for.  Only the latest few are kept."""
+        with self._profiles_lock:
+            self._profiles[token] = profile
+            while len(self._profiles) > 8:
+                self._profiles.popitem(last=False)
+
+    def pop_profile(self, token):
+        """Return and forget the profile kept for token, or None."""
+        with self._profiles_lock:
+            return self._profiles.pop(token, None)
+
+    def serve_until_quit(self):
+        """Handle requests until the server quits."""
+        while not self.quit:
+            self.handle_request()
+            if self.supervisor_pid and os.getppid() != self.supervisor_pid:
+                # The supervisor has gone away.
+                self.quit = True
+
+    def handle_timeout(self):
+        """Quit if no request has been received within idle_timeout."""
+        if self.idle_timeout:
+            idle = time.time() - self.last_request
+            if idle >= self.idle_timeout:
+                self.quit = True
+
+    def shutdown_request(self, request):
+        """Check memory use after each request."""
+        HTTPServer.shutdown_request(self, request)
+        self._check_rss()
+
+    def _check_rss(self):
+        """Ask the supervisor for a replacement if max_rss is exceeded.
+        The request is made once; the supervisor then retires this
+        process with SIGTERM."""
+        if self.recycle_fd is None or not self.max_rss:
+            return
+        rss = _rss()
+        if rss is not None and rss > self.max_rss:
+            os.write(self.recycle_fd, '{}\n'.format(os.getpid()).encode())
+            self.recycle_fd = None
+
+    def stats(self):
+        """Return a dict of statistics about the server process."""
+        stats = self.metrics.as_dict()
+        caches = {'index': {'hits': self.module_index.hits,
+                            'misses': self.module_index.misses},
+                  'json': {'hits': self.json_docs.hits,
+                           'misses': self.json_docs.misses},
+                  'source': {'hits': self.sources.hits,
+                             'misses': self.sources.misses}}
+        if self.archive is not None:
+            caches['archive'] = {'hits': self.archive.hits,
+                                 'misses': self.archive.misses}
+        stats.update({
+            'pid': os.getpid(),
+            'rss': _rss(),
+            'max_rss': self.max_rss,
+            'modules': len(sys.modules),
+            'recycles': self.recycles,
+            'caches': caches,
+        })
+        return stats
+
+
+def _rss():
+    """Return resident set size of the current process in bytes, or
+    None if it is not available."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def _fork_worker(server, recycle_fd):
+    """Fork a process that serves requests on the server's socket."""
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            server.supervisor_pid = os.getppid()
+            server.recycle_fd = recycle_fd
+            server.last_request = time.time()
+            server.serve_until_quit()
+            # Wait for requests in progress.
+            server.server_close()
+            status = 0
+        finally:
+            os._exit(status)
+    return pid
+
+
+def _serve_recycling(server):
+    """Serve requests in forked worker processes.
+
+    When a worker exceeds server.max_rss, a replacement is forked to
+    accept connections on the same listening socket and the old worker
+    is retired after the request it is handling.  The supervisor does
+    not handle requests, so it stays small.  It exits when the current
+    worker exits, for example on reaching the idle timeout, or at once
+    on SIGTERM, which it passes on to its workers.
     """
+    supervisor = os.getpid()
+    read_fd, write_fd = os.pipe()
+
+    def stop(*_):
+        """Quit.  In the supervisor, the loop is woken, and retires the
+        workers on leaving.  Inherited by workers, where it retires the
+        worker after the request it is handling.
+        """
+        server.quit = True
+        if os.getpid() == supervisor:
+            os.write(write_fd, b'\n')
+    signal.signal(signal.SIGTERM, stop)
+
+    worker = _fork_worker(server, write_fd)
+    retiring = set()
+    try:
+        while not server.quit:
+            ready, _, _ = select.select([read_fd], [], [], 1.0)
+            if ready:
+                pids = os.read(read_fd, 512).decode().split()
+                if str(worker) in pids:
+                    server.recycles += 1
+                    retiring.add(worker)
+                    worker = _fork_worker(server, write_fd)
+                    for pid in retiring:
+                        _signal(pid, signal.SIGTERM)
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            while pid:
+                retiring.discard(pid)
+                if pid == worker:
+                    worker = None
+                    return
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+    finally:
+        if worker is not None:
+            retiring.add(worker)
+        for pid in retiring:
+            _signal(pid, signal.SIGTERM)
+
 
-    # Monkey-patch input so that input does not raise EOFError when
-    # called by pydoc.cli
-    def input(_):  # pylint: disable=W0622
-        """Monkey-patched version of builtins.input"""
-        while 1:
-            time.sleep(1.0)
+def _signal(pid, signum):
+    """Send a signal, ignoring processes that have already exited."""
+    try:
+        os.kill(pid, signum)
+    except OSError:
+        pass
 
-    import builtins
-    builtins.input = input
-    sys.argv += ["-p", port]
-    pydoc.cli()
+
+def serve(port, idle_timeout=0, max_rss=0, archive=None,
+          keep_alive_timeout=5.0, live_url=None):
+    """Run the documentation server in the current process.
+
+    max_rss is in megabytes.  It is ignored where os.fork is not
+    available.  archive is the path of a file made by build_archive;
+    pages not in the archive are rendered by pydoc.  live_url is the
+    url of a LiveDocs server, asked for pages of objects that cannot
+    be imported.
+    """
+    _run_server(_make_server(port, idle_timeout, max_rss, archive,
+                             keep_alive_timeout, live_url))
 
 
-def start_server_background(port):
-    """Start the newtab server as a background process."""
+def _make_server(port, idle_timeout=0, max_rss=0, archive=None,
+                 keep_alive_timeout=5.0, live_url=None):
+    """Create a DocServer from the arguments of serve()."""
+    return DocServer(port, idle_timeout, max_rss * 1024 * 1024, archive,
+                     keep_alive_timeout, live_url)
+
+
+def _run_server(server):
+    """Handle requests until the server quits, then close it."""
+    try:
+        if server.max_rss and hasattr(os, 'fork'):
+            _serve_recycling(server)
+        else:
+            server.serve_until_quit()
+    finally:
+        _close_server(server)
+
+
+def _close_server(server):
+    """Close the server's socket and archive."""
+    server.server_close()
+    if server.archive is not None:
+        server.archive.close()
+
+
+def zygote(preload=()):
+    """Fork ready documentation servers on request.
+
+    Run in the process started by Zygote.  The modules named in preload
+    are imported first, so that forked servers start with them, sharing
+    their memory pages with the zygote.  Each line of input is a JSON
+    object holding the port and serve() options of a server to start.
+    The server socket is bound before forking, so the server accepts
+    connections as soon as the reply, holding the server's pid or an
+    error message, is written.  Replies also report the modules that
+    could not be preloaded.
+
+    A line holding a pid and a signal number instead asks for the
+    returncode of a server, None while it runs, and sends it the signal
+    if it is still running (0 only asks).  The zygote reaps its servers
+    before each request, so that only servers known to be running are
+    signalled.  At the end of its input, it stops the servers still
+    running and exits.
+
+    Replies are the only output on stdout: anything else printed, such
+    as by preloaded modules, goes to stderr.
+    """
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    preload_errors = {}
+    for name in preload:
+        try:
+            __import__(name)
+        except Exception as e:  # pylint: disable=W0703
+            preload_errors[name] = '{}: {}'.format(type(e).__name__, e)
+            traceback.print_exc()
+    # pid: returncode of servers that have exited.
+    exited = {}
+    children = set()
+    try:
+        for line in iter(sys.stdin.readline, ''):
+            request = json.loads(line)
+            _reap_children(children, exited)
+            if 'signal' in request:
+                pid = request['pid']
+                if pid in children:
+                    if request['signal']:
+                        _signal(pid, request['signal'])
+                    reply = {'returncode': None}
+                else:
+                    reply = {'returncode': exited.get(pid, 0)}
+            else:
+                reply = _zygote_fork(request, replies, children)
+                reply['preload_errors'] = preload_errors
+            replies.write(json.dumps(reply) + '\n')
+            replies.flush()
+    finally:
+        _reap_children(children, exited)
+        for pid in children:
+            _signal(pid, signal.SIGTERM)
+
+
+def _zygote_fork(request, replies, children):
+    """Fork the server asked for by a zygote request; return the reply,
+    holding its pid or an error message."""
+    try:
+        server = _make_server(request['port'], **request['options'])
+    except (IOError, OSError) as e:
+        return {'error': str(e)}
+    pid = os.fork()
+    if pid == 0:
+        replies.close()
+        _zygote_child(server)
+    _close_server(server)
+    children.add(pid)
+    return {'pid': pid}
+
+
+def _reap_children(children, exited):
+    """Reap the children that have exited, moving their pids from
+    children to exited, with their returncodes."""
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except OSError:
+            return
+        if pid == 0:
+            return
+        children.discard(pid)
+        if os.WIFSIGNALED(status):
+            exited[pid] = -os.WTERMSIG(status)
+        else:
+            exited[pid] = os.WEXITSTATUS(status)
+
+
+def _zygote_child(server):
+    """Run a server forked by the zygote."""
+    status = 1
+    try:
+        devnull = os.open(os.devnull, os.O_RDWR)
+        os.dup2(devnull, 0)
+        os.dup2(devnull, 1)
+        _run_server(server)
+        status = 0
+    finally:
+        os._exit(status)
+
+
+def start_server_background(port, stdout=None, stderr=None, **options):
+    """Start the newtab server as a background process; return its
+    subprocess.Popen.
+
+    stdout and stderr are files for the output of the process.  Other
+    keyword options are passed to serve().  They are ignored in
+    Python 2, where the server is pydoc.serve.
+    """
 
     if sys.version_info[0] == 2:
         lines = ('import pydoc\n'
@@ -329,16 +2833,32 @@ def start_server_background(port):
         lines = ('import sys\n'
                  'sys.path.append({path})\n'
                  'import newtabmagic\n'
-                 'newtabmagic.pydoc_cli_monkey_patched({port})')
-        cell = lines.format(path=path, port=port)
+                 'newtabmagic.serve({port}, **{options!r})')
+        cell = lines.format(path=path, port=port, options=options)
+
+    return subprocess.Popen([sys.executable, '-c', cell],
+                            stdout=stdout, stderr=stderr)
+
+
+def _wait_for_port(port, timeout, running):
+    """Wait until a server accepts connections on port.  Returns False
+    if it does not within timeout seconds, or running() becomes false.
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except (IOError, OSError):
+            if time.time() > deadline or not running():
+                return False
+            time.sleep(0.02)
 
-    # Use script cell magic so that shutting down IPython stops
-    # the server process.
-    line = "python --proc proc --bg --err error --out output"
-    ip = get_ipython()
-    ip.run_cell_magic("script", line, cell)
 
-    return ip.user_ns['proc']
+def _read_file(f):
+    """Contents of an output file of a process, decoded."""
+    f.seek(0)
+    return f.read().decode('utf-8', 'replace')
 
 
 def _port_not_in_use():
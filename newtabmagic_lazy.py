@@ -0,0 +1,56 @@
+"""newtabmagic_lazy: register %newtab without loading newtabmagic.
+
+Loading newtabmagic imports pydoc, subprocess, socket, webbrowser,
+fullqualname and IPython's magic argument parser, which slows down
+IPython startup in sessions that never open a tab.  This module
+registers a stub %newtab instead; the first call imports newtabmagic,
+loads the extension with the saved settings and runs the command.
+
+In an IPython startup file:
+
+    import newtabmagic_lazy
+    newtabmagic_lazy.register(get_ipython(), port=8880, browser='firefox')
+
+``%load_ext newtabmagic_lazy`` registers the stub without settings.
+"""
+
+
+def register(ip, port=None, browser=None):
+    """Register a stub %newtab magic with the IPython shell ip.
+
+    port and browser are applied when newtabmagic is loaded, as if by
+    %newtab --port and %newtab --browser.
+    """
+    magics = []
+
+    def newtab(line):
+        """Open new browser tabs showing pydoc documentation.
+
+        newtabmagic is loaded on first use; see %newtab? after that.
+        """
+        if not magics:
+            magics.append(_load(ip, port, browser))
+        return magics[0].newtab(line)
+
+    ip.register_magic_function(newtab, 'line', 'newtab')
+
+
+def _load(ip, port, browser):
+    """Load the newtabmagic extension with the saved settings; return
+    its NewTabMagics instance."""
+    # Loading through the extension manager records newtabmagic as
+    # loaded, so that %load_ext newtabmagic keeps this instance.
+    ip.extension_manager.load_extension('newtabmagic')
+    magics = ip.magics_manager.registry['NewTabMagics']
+    if port is not None:
+        magics.port = port
+    if browser is not None:
+        magics.browser = [browser]
+    # Replaces the stub, if the extension was already loaded.
+    ip.register_magics(magics)
+    return magics
+
+
+def load_ipython_extension(ip):
+    """Register the stub %newtab magic."""
+    register(ip)
@@ -25,7 +25,7 @@ keywords = 'CLI documentation IPython pydoc'
 setup(
     name='newtabmagic',
     version=__version__,
-    py_modules=['newtabmagic'],
+    py_modules=['newtabmagic', 'newtabmagic_lazy'],
     author='Eric Galloway',
     author_email='ericgalloway@gmail.com',
     description=description,
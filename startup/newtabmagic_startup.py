@@ -1,4 +1,12 @@
+port = 8880
+browser = r'C:\Program Files (x86)\Google\Chrome\Application\chrome.exe'
 ip = get_ipython()
-ip.run_cell('%load_ext newtabmagic')
-ip.run_cell('%newtab --port 8880')
-ip.run_cell('%newtab --browser C:\Program Files (x86)\Google\Chrome\Application\chrome.exe')
+try:
+    import newtabmagic_lazy
+except ImportError:
+    # %install_ext installs newtabmagic.py only.
+    ip.run_cell('%load_ext newtabmagic')
+    ip.run_cell('%newtab --port {}'.format(port))
+    ip.run_cell('%newtab --browser {}'.format(browser))
+else:
+    newtabmagic_lazy.register(ip, port=port, browser=browser)
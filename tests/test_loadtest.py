@@ -0,0 +1,100 @@
+"""Tests for benchmarks/loadtest.py.
+
+To run tests:
+
+    nosetests
+
+"""
+# pylint: disable=C0111
+import contextlib
+import os
+import sys
+import threading
+
+import nose
+
+if sys.version_info.major == 2:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from StringIO import StringIO
+else:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from io import StringIO
+
+if sys.version_info >= (3, 3):
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+# Import the benchmark without leaving its directory, or the one it adds,
+# on sys.path, which other tests count.
+_path = list(sys.path)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks'))
+import loadtest  # noqa: E402
+sys.path[:] = _path
+
+
+def test_parse_mix():
+    nose.tools.assert_equals(loadtest.parse_mix('module=1, index=0.5'),
+                             {'module': 1.0, 'index': 0.5})
+    nose.tools.assert_raises(loadtest.argparse.ArgumentTypeError,
+                             loadtest.parse_mix, 'modules=1')
+    nose.tools.assert_raises(loadtest.argparse.ArgumentTypeError,
+                             loadtest.parse_mix, 'module=x')
+
+
+def test_main_unknown_kind():
+    with patch('sys.stderr', StringIO()) as err:
+        nose.tools.assert_raises(SystemExit, loadtest.main,
+                                 ['--mix', 'modules=1'])
+    assert "unknown page kind 'modules'" in err.getvalue()
+
+
+def _run(argv):
+    out = StringIO()
+    with patch('sys.stdout', out):
+        loadtest.main(argv)
+    return out.getvalue()
+
+
+def test_main_smoke():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+    output = _run(['--clients', '2', '--duration', '5', '--requests', '2',
+                   '--mix', 'index=1,module=1', '--modules', 'json'])
+    assert 'requests: 4  errors: 0 ' in output
+    assert 'index cache: ' in output
+
+
+class _PlainHandler(BaseHTTPRequestHandler):
+    """Serves an empty page at every path but STATS_PATH."""
+
+    def do_GET(self):  # pylint: disable=C0103
+        status = 404 if self.path == loadtest.newtabmagic.STATS_PATH else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def _plain_server():
+    server = HTTPServer(('127.0.0.1', 0), _PlainHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+def test_main_url_without_stats():
+    with _plain_server() as url:
+        output = _run(['--url', url, '--clients', '1', '--requests', '2',
+                       '--duration', '5', '--mix', 'index=1'])
+    assert 'requests: 2  errors: 0 ' in output
+    assert 'no server statistics: ' in output
@@ -7,11 +7,23 @@ To run tests:
 """
 # pylint: disable=C0111, C0321, R0903
 import contextlib
+import gzip
 import inspect
 import nose
+import pstats
 import pydoc
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
 import sys
+import tempfile
+import threading
 import time
+import types
+import zipfile
 
 import IPython
 from IPython.core.error import UsageError
@@ -27,6 +39,12 @@ if sys.version_info >= (3, 3):
 else:
     from mock import patch
 
+try:
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+except ImportError:
+    from urllib2 import HTTPError, Request, urlopen
+
 if not IPython.get_ipython():
     from IPython.testing import globalipapp
     globalipapp.start_ipython()
@@ -62,7 +80,8 @@ def _newtabmagic_message(newtab, arg):
 def _newtabmagic_UsageError(newtab, args):
     """Return UsageError raised by newtabmagic command, or None if none."""
     try:
-        newtab.newtab(args)
+        with _server_start_patched():
+            newtab.newtab(args)
     except UsageError as e:
         error = e
     else:
@@ -70,9 +89,15 @@ def _newtabmagic_UsageError(newtab, args):
     return error
 
 
+def _server_start_patched():
+    """Patch ServerProcess.start so that opening tabs does not start
+    the server."""
+    return patch.object(newtabmagic.ServerProcess, 'start')
+
+
 def _open_new_tab(newtab, args):
     with patch('sys.stdout', StringIO()) as out:
-        with patch('subprocess.Popen') as mock_call:
+        with patch('subprocess.Popen') as mock_call, _server_start_patched():
             newtab.newtab(args)
         msg = out.getvalue()
     return msg, mock_call
@@ -82,7 +107,7 @@ def _newtabmagic_object_page_name(obj):
     """Return path part of help url not including extension."""
     newtab = _get_newtabmagic()
     newtab.shell.push({'obj': obj})
-    with patch('subprocess.Popen') as mock_call:
+    with patch('subprocess.Popen') as mock_call, _server_start_patched():
         newtab.newtab('obj')
     call_args = mock_call.call_args[0][0]
     url = call_args[1]
@@ -143,11 +168,8 @@ def test_server_start_stop():
     # Start server
     result = _newtabmagic_message(newtab, '--server start')
 
-    expected = ("Starting job # ? in a separate thread.\n"
-                "Server running at {}\n".format(newtab.base_url))
-    head, tail = expected.split('?')
-    nose.tools.assert_true(result.startswith(head))
-    nose.tools.assert_true(result.endswith(tail))
+    expected = "Server running at {}\n".format(newtab.base_url)
+    nose.tools.assert_equals(result, expected)
 
     # Stop server
     result = _newtabmagic_message(newtab, '--server stop')
@@ -156,6 +178,71 @@ def test_server_start_stop():
     nose.tools.assert_equal(result, expected)
 
 
+def test_server_start_port_in_use():
+    newtab = _get_newtabmagic()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(('127.0.0.1', 0))
+        newtab.port = sock.getsockname()[1]
+        start = time.time()
+        with patch('sys.stdout', StringIO()) as out:
+            with patch.object(newtabmagic.BrowserLauncher,
+                              'launch') as launch:
+                try:
+                    newtab.newtab('json')
+                except UsageError as e:
+                    msg = str(e)
+                else:
+                    raise AssertionError('UsageError not raised')
+    finally:
+        sock.close()
+    assert time.time() - start < newtab._server.start_timeout
+    assert msg.startswith('Server could not be started: ')
+    assert 'Address already in use' in msg
+    nose.tools.assert_equals(out.getvalue(), '')
+    nose.tools.assert_equals(launch.call_count, 0)
+
+
+def test_server_stop_stops_live_docs():
+    newtab = _get_newtabmagic()
+    newtab.shell.push({'Live': _live_class()})
+    with patch('sys.stdout', StringIO()):
+        newtab.newtab('--server start')
+        try:
+            # Nothing is served until an object is registered.
+            assert not newtab._live_docs.running()
+            newtab._get_pydoc_page_name('Live')
+            assert newtab._live_docs.running()
+        finally:
+            newtab.newtab('--server stop')
+            newtab.shell.events.unregister('post_execute',
+                                           newtab._refresh_live_docs)
+    assert not newtab._live_docs.running()
+
+
+def test_open_tabs_server_ready():
+    # The server is started by the first lookup and accepts connections
+    # before the browser is launched; later lookups reuse it.
+
+    newtab = _get_newtabmagic()
+    statuses = []
+
+    def launch(cmd):
+        statuses.append(urlopen(cmd[1]).getcode())
+
+    try:
+        with patch('sys.stdout', StringIO()) as out:
+            with patch.object(newtabmagic.BrowserLauncher, 'launch',
+                              side_effect=launch):
+                newtab.newtab('sys')
+                newtab.newtab('os')
+        nose.tools.assert_equals(statuses, [200, 200])
+        nose.tools.assert_equals(
+            out.getvalue(), 'Server running at {}\n'.format(newtab.base_url))
+    finally:
+        newtab.newtab('--server stop')
+
+
 def test_server_stop_not_started():
 
     newtab = _get_newtabmagic()
@@ -191,6 +278,13 @@ def test_server_already_stopped():
     nose.tools.assert_equals(result, expected)
 
 
+def test_server_stats_not_running():
+
+    newtab = _get_newtabmagic()
+    result = _newtabmagic_message(newtab, '--server stats')
+    nose.tools.assert_equals(result, 'Server statistics not available.\n')
+
+
 def test_server_process_read():
 
     newtab = _get_newtabmagic()
@@ -224,8 +318,20 @@ def test_show():
     result = _newtabmagic_message(newtab, '--show')
 
     expected = ['browser: firefox',
+                'warm: False',
+                'warm allow: any',
+                'warm deny: none',
+                'warm limit: 2',
+                'warm queue: 0 queued, 0 warming, 0 warmed, 0 failed',
+                'browser launches: 0',
+                'browser launch failures: 0',
+                'browser launches running: 0',
                 'server running: False',
                 'server port: 8880',
+                'server idle timeout: 0',
+                'server max rss: 0',
+                'server archive: None',
+                'server zygote: None',
                 'server root url: http://127.0.0.1:8880/',
                 '']
     nose.tools.assert_equals(result.split('\n'), expected)
@@ -235,16 +341,68 @@ def test_show():
         result = _newtabmagic_message(newtab, '--show')
 
     expected = ['browser: firefox',
+                'warm: False',
+                'warm allow: any',
+                'warm deny: none',
+                'warm limit: 2',
+                'warm queue: 0 queued, 0 warming, 0 warmed, 0 failed',
+                'browser launches: 0',
+                'browser launch failures: 0',
+                'browser launches running: 0',
                 'server poll: None',
                 'server running: True',
                 'server port: 8880',
+                'server idle timeout: 0',
+                'server max rss: 0',
+                'server archive: None',
+                'server zygote: None',
                 'server root url: http://127.0.0.1:8880/',
                 '']
-    diff = [line for line in result.split('\n') if line not in expected]
+    stats = ('server rss: ', 'server modules: ', 'server recycles: ')
+    diff = [line for line in result.split('\n')
+            if line not in expected and not line.startswith(stats)]
     nose.tools.assert_equals(len(diff), 1)
     assert diff[0].startswith('server pid: ')
 
 
+def test_set_idle_timeout():
+    newtab = _get_newtabmagic()
+    newtab.newtab('--idle-timeout 600')
+    nose.tools.assert_equals(newtab._server.idle_timeout, 600)
+
+
+def test_set_max_rss():
+    newtab = _get_newtabmagic()
+    newtab.newtab('--max-rss 2048')
+    nose.tools.assert_equals(newtab._server.max_rss, 2048)
+
+
+def test_name_argument_starts_server():
+    # Opening a tab starts the server if it is not running.
+
+    newtab = _get_newtabmagic()
+    with patch.object(newtabmagic.ServerProcess, 'running',
+                      return_value=False):
+        with patch('subprocess.Popen'), _server_start_patched() as start:
+            newtab.newtab('sys')
+    nose.tools.assert_equals(start.call_count, 1)
+
+    with patch.object(newtabmagic.ServerProcess, 'running',
+                      return_value=True):
+        with patch('subprocess.Popen'), _server_start_patched() as start:
+            newtab.newtab('sys')
+    nose.tools.assert_equals(start.call_count, 0)
+
+
+def test_name_argument_not_found_does_not_start_server():
+
+    newtab = _get_newtabmagic()
+    with patch('sys.stdout', StringIO()):
+        with _server_start_patched() as start:
+            newtab.newtab('does.not.exist')
+    nose.tools.assert_equals(start.call_count, 0)
+
+
 def test_newtab_name_argument():
     # Test for a single name argument
 
@@ -277,12 +435,122 @@ def test_newtab_name_arguments():
         nose.tools.assert_equals(mock_cmd, expected)
 
 
+def test_name_arguments_same_page():
+    # Names resolving to the same page open one tab.
+
+    newtab = _get_newtabmagic()
+    newtab.shell.push({'a': C4(), 'A': C4})
+    output, mock_call = _open_new_tab(newtab, 'a.method A.method')
+    nose.tools.assert_equals(output, '')
+    url = newtab.base_url + 'tests.test_newtabmagic.C4.method.html'
+    mock_call.assert_called_once_with([newtab.browser, url])
+
+
+def test_name_argument_recently_opened():
+    # A tab is not reopened within the dedup window.
+
+    newtab = _get_newtabmagic()
+    _open_new_tab(newtab, 'sys')
+    output, mock_call = _open_new_tab(newtab, 'sys')
+    nose.tools.assert_equals(output, 'Tab recently opened: sys\n')
+    nose.tools.assert_equals(mock_call.call_count, 0)
+
+    output, mock_call = _open_new_tab(newtab, '--force sys')
+    nose.tools.assert_equals(output, '')
+    nose.tools.assert_equals(mock_call.call_count, 1)
+
+
+def test_dedup_window_zero():
+
+    newtab = _get_newtabmagic()
+    newtab.newtab('--dedup-window 0')
+    _open_new_tab(newtab, 'sys')
+    output, mock_call = _open_new_tab(newtab, 'sys')
+    nose.tools.assert_equals(output, '')
+    nose.tools.assert_equals(mock_call.call_count, 1)
+
+
+def test_newtab_async():
+    # --async returns before the work is done; output is printed
+    # when it is.
+
+    newtab = _get_newtabmagic()
+    done = threading.Event()
+    open_new_tabs = newtab._open_new_tabs
+
+    def slow_open_new_tabs(names, force=False, source=False):
+        done.wait(5)
+        open_new_tabs(names, force, source)
+
+    newtab._open_new_tabs = slow_open_new_tabs
+    with patch('sys.stdout', StringIO()) as out:
+        with patch('subprocess.Popen') as mock_call, _server_start_patched():
+            newtab.newtab('--async does.not.exist sys')
+            nose.tools.assert_equals(mock_call.call_count, 0)
+            print('after')
+            done.set()
+            newtab._jobs.join()
+        msg = out.getvalue()
+    nose.tools.assert_equals(msg, 'after\nDocumentation not found: '
+                                  'does.not.exist\n')
+    nose.tools.assert_equals(mock_call.call_count, 1)
+
+
+def test_JobQueue_output_redirected_meanwhile():
+    # Redirecting sys.stdout while a job runs neither captures the
+    # job's output nor loses the output of later jobs.
+
+    jobs = newtabmagic.JobQueue()
+    started = threading.Event()
+    release = threading.Event()
+
+    def job1():
+        started.set()
+        release.wait(5)
+        newtabmagic._print('job1 out')
+
+    with patch('sys.stdout', StringIO()) as out:
+        jobs.submit(job1)
+        started.wait(5)
+        with patch('sys.stdout', StringIO()) as other:
+            release.set()
+            jobs.join()
+        jobs.submit(lambda: newtabmagic._print('job2 out'))
+        jobs.join()
+    nose.tools.assert_equals(other.getvalue(), '')
+    nose.tools.assert_equals(out.getvalue(), 'job1 out\njob2 out\n')
+
+
+def test_newtab_async_default():
+
+    newtab = _get_newtabmagic()
+    newtab.async_default = True
+    with patch.object(newtab._jobs, 'submit') as submit:
+        newtab.newtab('sys')
+        nose.tools.assert_equals(submit.call_count, 1)
+        with patch('subprocess.Popen'), _server_start_patched():
+            newtab.newtab('--sync sys')
+        nose.tools.assert_equals(submit.call_count, 1)
+
+
+def test_newtab_async_usage_error():
+
+    newtab = _get_newtabmagic(browser='nonexistent')
+    with patch('sys.stdout', StringIO()) as out:
+        with _server_start_patched():
+            newtab.newtab('--async sys')
+            newtab._jobs.join()
+        msg = out.getvalue()
+    assert msg.startswith("UsageError: the command 'nonexistent ")
+
+
 def test_name_argument_browser_is_None():
     # Use webbrowser.open_new_tab if browser is None.
 
     newtab = _get_newtabmagic(browser=None)
     with patch('sys.stdout', StringIO()) as out:
-        with patch('webbrowser.open_new_tab') as mock_call:
+        with patch('webbrowser.open_new_tab') as mock_call, \
+                _server_start_patched():
             newtab.newtab("sys")
         msg = out.getvalue()
     nose.tools.assert_equals(msg, "")
@@ -655,3 +923,999 @@ def test_ServerProcess_port():
     assert process.port == p
     process.port = q
     assert process.port == q
+
+
+@contextlib.contextmanager
+def temporary_directory():
+    path = tempfile.mkdtemp()
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path)
+
+
+@contextlib.contextmanager
+def doc_server(**options):
+    """Run a DocServer in a thread of the current process."""
+    server = newtabmagic.DocServer(0, **options)
+    thread = threading.Thread(target=server.serve_until_quit)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.quit = True
+        thread.join(5)
+        server.server_close()
+
+
+def _server_url(server):
+    return 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+
+def test_DocServer_page():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+
+    with doc_server() as server:
+        response = urlopen(_server_url(server) + 'sys.html')
+        body = response.read().decode('utf-8')
+    nose.tools.assert_equals(response.getcode(), 200)
+    assert 'sys' in body
+
+
+def test_DocServer_idle_timeout():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+
+    server = newtabmagic.DocServer(0, idle_timeout=0.2)
+    thread = threading.Thread(target=server.serve_until_quit)
+    thread.daemon = True
+    thread.start()
+    thread.join(5)
+    server.server_close()
+    assert not thread.is_alive()
+
+
+def test_DocServer_stats():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+
+    with doc_server() as server:
+        response = urlopen(_server_url(server) + '__newtab_stats')
+        stats = json.loads(response.read().decode('utf-8'))
+    nose.tools.assert_equals(stats['pid'], os.getpid())
+    nose.tools.assert_equals(stats['modules'], len(sys.modules))
+    nose.tools.assert_equals(stats['recycles'], 0)
+
+
+def test_rss():
+    if not os.path.exists('/proc/self/status'):
+        raise nose.SkipTest('/proc/self/status not available')
+    assert newtabmagic._rss() > 0
+
+
+def test_serve_recycles_worker_over_max_rss():
+    if not os.path.exists('/proc/self/status') or not hasattr(os, 'fork'):
+        raise nose.SkipTest('requires /proc/self/status and os.fork')
+
+    port = newtabmagic._port_not_in_use()
+    path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = ('import sys\n'
+            'sys.path.insert(0, {!r})\n'
+            'import newtabmagic\n'
+            'newtabmagic.serve({}, max_rss=1)').format(path, port)
+    process = subprocess.Popen([sys.executable, '-c', code])
+    url = 'http://127.0.0.1:{}/'.format(port)
+    try:
+        pids = set()
+        for _ in range(50):
+            try:
+                urlopen(url + 'sys.html', timeout=5).read()
+                stats = json.loads(urlopen(url + '__newtab_stats').read()
+                                   .decode('utf-8'))
+            except IOError:
+                time.sleep(0.1)
+                continue
+            pids.add(stats['pid'])
+            if stats['recycles'] >= 2:
+                break
+        assert stats['recycles'] >= 2
+        assert process.pid not in pids
+        assert len(pids) >= 2
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def test_serve_recycling_stops_on_sigterm():
+    if not os.path.exists('/proc/self/status') or not hasattr(os, 'fork'):
+        raise nose.SkipTest('requires /proc/self/status and os.fork')
+
+    port = newtabmagic._port_not_in_use()
+    process = newtabmagic.start_server_background(port, max_rss=1024)
+    try:
+        assert newtabmagic._wait_for_port(port, 10, lambda: True)
+        stats = json.loads(urlopen('http://127.0.0.1:{}{}'.format(
+            port, newtabmagic.STATS_PATH)).read().decode('utf-8'))
+        worker = stats['pid']
+        assert worker != process.pid
+        # The supervisor exits within the grace period of --server stop.
+        with patch('sys.stdout', StringIO()) as out:
+            newtabmagic._stop_process(process, 'Server process')
+        nose.tools.assert_equals(out.getvalue(),
+                                 'Server process is terminated.\n')
+        nose.tools.assert_equals(process.returncode, 0)
+        # The worker is retired.
+        for _ in range(50):
+            try:
+                os.kill(worker, 0)
+            except OSError:
+                break
+            time.sleep(0.1)
+        else:
+            raise AssertionError('worker still running')
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+
+def _wait_for_launches(launcher):
+    for _ in range(100):
+        if not launcher.running():
+            break
+        time.sleep(0.05)
+
+
+def test_BrowserLauncher_reaps_children():
+    launcher = newtabmagic.BrowserLauncher()
+    launcher.launch([sys.executable, '-c', 'pass'])
+    launcher.launch([sys.executable, '-c', 'raise SystemExit(1)'])
+    _wait_for_launches(launcher)
+    nose.tools.assert_equals(launcher.running(), 0)
+    nose.tools.assert_equals(launcher.launches, 2)
+    nose.tools.assert_equals(launcher.failures, 1)
+
+    with patch('sys.stdout', StringIO()) as out:
+        launcher.show()
+    assert 'browser launch latency: ' in out.getvalue()
+
+
+def test_BrowserLauncher_limits_launches():
+    launcher = newtabmagic.BrowserLauncher(max_launching=1)
+    cmd = [sys.executable, '-c', 'import time; time.sleep(0.5)']
+    start = time.time()
+    launcher.launch(cmd)
+    launcher.launch(cmd)
+    assert time.time() - start >= 0.4
+    _wait_for_launches(launcher)
+
+
+def test_BrowserLauncher_launch_timeout():
+    # A long-running launch stops counting after launch_timeout.
+    launcher = newtabmagic.BrowserLauncher(max_launching=1,
+                                           launch_timeout=0.1)
+    cmd = [sys.executable, '-c', 'import time; time.sleep(1.0)']
+    start = time.time()
+    launcher.launch(cmd)
+    launcher.launch(cmd)
+    assert time.time() - start < 0.9
+    _wait_for_launches(launcher)
+
+
+def test_BrowserLauncher_browser_session():
+    # A command that becomes the browser records launch_timeout as its
+    # latency, and being killed later is not a launch failure.
+    launcher = newtabmagic.BrowserLauncher(launch_timeout=0.2)
+    code = 'import time; time.sleep(0.6); raise SystemExit(1)'
+    launcher.launch([sys.executable, '-c', code])
+    _wait_for_launches(launcher)
+    nose.tools.assert_equals(launcher.running(), 0)
+    nose.tools.assert_equals(launcher.failures, 0)
+    nose.tools.assert_equals(launcher._latency_count, 1)
+    nose.tools.assert_equals(launcher._latency_max, 0.2)
+
+
+def test_build_archive():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+
+    with temporary_directory() as tmp:
+        path = os.path.join(tmp, 'docs.zip')
+        newtabmagic.build_archive(path, ['json'])
+        archive = newtabmagic.DocArchive(path)
+        try:
+            for page in ['/pydoc_data/_pydoc.css', '/json.html',
+                         '/json.decoder.html',
+                         '/json.decoder.JSONDecoder.html']:
+                assert page in archive, page
+            assert '/sys.html' not in archive
+            # The server renders the index itself.
+            assert '/' not in archive
+        finally:
+            archive.close()
+
+
+def test_build_archive_skips_broken_submodules():
+    with temporary_directory() as tmp:
+        package = os.path.join(tmp, 'archive_pkg')
+        os.mkdir(package)
+        for name, code in [('__init__.py', ''),
+                           ('good.py', 'def f():\n    pass\n'),
+                           ('bad.py', 'import no_such_module_xyz\n')]:
+            with open(os.path.join(package, name), 'w') as f:
+                f.write(code)
+        sys.path.insert(0, tmp)
+        try:
+            pages = newtabmagic._module_pages('archive_pkg')
+            path = os.path.join(tmp, 'docs.zip')
+            newtabmagic.build_archive(path, ['archive_pkg'])
+            with zipfile.ZipFile(path) as archive:
+                names = archive.namelist()
+        finally:
+            sys.path.remove(tmp)
+            for name in list(sys.modules):
+                if name.startswith('archive_pkg'):
+                    del sys.modules[name]
+    nose.tools.assert_equals(sorted(pages), [
+        'archive_pkg', 'archive_pkg.good', 'archive_pkg.good.f'])
+    assert 'archive_pkg.good.f.html' in names
+
+
+def _get(url, **headers):
+    response = urlopen(Request(url, headers=headers))
+    return response.info(), response.read()
+
+
+def test_DocServer_archive():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+
+    with temporary_directory() as tmp:
+        path = os.path.join(tmp, 'docs.zip')
+        newtabmagic.build_archive(path, ['json'])
+        with zipfile.ZipFile(path) as archive:
+            expected = archive.read('json.html')
+        with doc_server(archive=path) as server:
+            url = _server_url(server)
+            info, body = _get(url + 'json.html',
+                              **{'Accept-Encoding': 'gzip'})
+            nose.tools.assert_equals(info['Content-Encoding'], 'gzip')
+            nose.tools.assert_equals(gzip.decompress(body), expected)
+
+            info, body = _get(url + 'json.html')
+            nose.tools.assert_equals(info['Content-Encoding'], None)
+            nose.tools.assert_equals(body, expected)
+
+            # Pages not in the archive are rendered by pydoc.
+            info, body = _get(url + 'sys.html')
+            assert b'sys' in body
+
+            # The index is the server's, not an archived copy.
+            with patch.object(server.module_index, 'page',
+                              return_value='Live index') as page:
+                _, body = _get(url)
+            nose.tools.assert_equals(body, b'Live index')
+            nose.tools.assert_equals(page.call_count, 1)
+
+
+def test_ModuleIndex_rescans_changed_entries():
+    with temporary_directory() as tmp:
+        sys.path.append(tmp)
+        try:
+            index = newtabmagic.ModuleIndex()
+            index.refresh()
+            nose.tools.assert_equals(index.rescanned, len(sys.path))
+            index.refresh()
+            nose.tools.assert_equals(index.rescanned, 0)
+
+            with open(os.path.join(tmp, 'newtab_index_test.py'), 'w'):
+                pass
+            # Make sure the directory mtime changes.
+            mtime = os.stat(tmp).st_mtime + 1
+            os.utime(tmp, (mtime, mtime))
+            index.refresh()
+            nose.tools.assert_equals(index.rescanned, 1)
+            path, modules = index.modules()[-1]
+            nose.tools.assert_equals(path, tmp)
+            nose.tools.assert_equals(modules,
+                                     [('newtab_index_test', False, False)])
+        finally:
+            sys.path.remove(tmp)
+
+
+def test_DocServer_index():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+
+    with doc_server() as server:
+        body = urlopen(_server_url(server)).read().decode('utf-8')
+    assert 'Index of Modules' in body
+    assert '<a href="json.html"><strong>json</strong>&nbsp;(package)</a>' \
+        in body
+
+
+def test_route():
+    routes = [('/__newtab_stats', 'stats'),
+              ('/', 'index'),
+              ('/index.html', 'index'),
+              ('/pydoc_data/_pydoc.css', 'css'),
+              ('/keywords.html', 'topics'),
+              ('/search?key=json', 'search'),
+              ('/get?key=json', 'get'),
+              ('/topic?key=if', 'topics'),
+              ('/anything?x', 'other'),
+              ('/json.html?x', 'other'),
+              ('/json.decoder.html', 'page'),
+              ('/favicon.ico', 'other')]
+    for path, route in routes:
+        nose.tools.assert_equals(newtabmagic._route(path), route)
+
+
+def test_ServerStats():
+    stats = newtabmagic.ServerStats()
+    for _ in range(3):
+        start = stats.request_started()
+    nose.tools.assert_equals(stats.as_dict()['in_flight'], 3)
+    stats.request_finished('page', 0.003, 100, import_time=0.001)
+    stats.request_finished('page', 0.030, 50)
+    stats.request_finished('css', 0.0005, 10)
+    result = stats.as_dict()
+    nose.tools.assert_equals(result['in_flight'], 0)
+    nose.tools.assert_equals(result['requests'], 3)
+    nose.tools.assert_equals(result['bytes_sent'], 160)
+    nose.tools.assert_almost_equals(result['import_time'], 0.001)
+    nose.tools.assert_almost_equals(result['render_time'], 0.032)
+    page = result['routes']['page']
+    nose.tools.assert_equals(page['count'], 2)
+    # 3 ms falls in the (2, 5] bucket; 30 ms in the (20, 50] bucket.
+    nose.tools.assert_equals(page['histogram'][2], 1)
+    nose.tools.assert_equals(page['histogram'][5], 1)
+    nose.tools.assert_equals(
+        newtabmagic._percentile(page['histogram'], result['buckets'], 0.5),
+        5)
+    assert start <= time.time()
+
+
+def test_DocServer_stats_routes():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+
+    with doc_server() as server:
+        url = _server_url(server)
+        urlopen(url + 'json.html').read()
+        urlopen(url).read()
+        urlopen(url).read()
+        # Requests are recorded after their responses are sent.
+        for _ in range(20):
+            stats = json.loads(urlopen(url + '__newtab_stats').read()
+                               .decode('utf-8'))
+            if stats['requests'] >= 3 + 1:
+                break
+            time.sleep(0.05)
+    nose.tools.assert_equals(stats['routes']['page']['count'], 1)
+    nose.tools.assert_equals(stats['routes']['index']['count'], 2)
+    assert stats['in_flight'] >= 1
+    assert stats['bytes_sent'] > 0
+    index = stats['caches']['index']
+    nose.tools.assert_equals(index['misses'], len(sys.path))
+    nose.tools.assert_equals(index['hits'], len(sys.path))
+    summary = newtabmagic.format_stats(stats)
+    assert 'index cache: ' in summary
+    assert any(line.startswith('page ') for line in summary.split('\n'))
+
+
+def test_Zygote_fork_server():
+    if sys.version_info[0] == 2 or not hasattr(os, 'fork'):
+        raise nose.SkipTest('requires Python 3 and os.fork')
+
+    zygote = newtabmagic.Zygote(['json'])
+    zygote.start()
+    try:
+        port = newtabmagic._port_not_in_use()
+        process = zygote.fork_server(port, idle_timeout=0)
+        assert process.poll() is None
+        url = 'http://127.0.0.1:{}/'.format(port)
+        stats = json.loads(urlopen(url + '__newtab_stats').read()
+                           .decode('utf-8'))
+        nose.tools.assert_equals(stats['pid'], process.pid)
+        assert 'json' in urlopen(url + 'json.html').read().decode('utf-8')
+
+        # Port in use
+        try:
+            zygote.fork_server(port)
+        except OSError:
+            pass
+        else:
+            raise AssertionError('OSError not raised')
+
+        process.terminate()
+        for _ in range(50):
+            if process.poll() is not None:
+                break
+            time.sleep(0.05)
+        nose.tools.assert_equals(process.poll(), -signal.SIGTERM)
+    finally:
+        zygote.stop()
+    assert not zygote.running()
+
+
+def test_Zygote_reaps_servers():
+    if sys.version_info[0] == 2 or not hasattr(os, 'fork'):
+        raise nose.SkipTest('requires Python 3 and os.fork')
+
+    zygote = newtabmagic.Zygote()
+    zygote.start()
+    try:
+        port = newtabmagic._port_not_in_use()
+        process = zygote.fork_server(port, idle_timeout=1)
+        assert process.poll() is None
+        # The server exits on its own, and is reaped by the zygote.
+        for _ in range(100):
+            if process.poll() is not None:
+                break
+            time.sleep(0.05)
+        nose.tools.assert_equals(process.poll(), 0)
+        # Exited servers are not signalled: their pids may be reused.
+        with patch.object(newtabmagic.Zygote, '_request') as request:
+            process.terminate()
+            process.kill()
+        nose.tools.assert_equals(request.call_count, 0)
+        nose.tools.assert_equals(
+            zygote.signal_server(process.pid, signal.SIGKILL), 0)
+
+        other = zygote.fork_server(newtabmagic._port_not_in_use())
+        assert other.poll() is None
+    finally:
+        zygote.stop()
+    # Servers of a stopped zygote are stopped.
+    nose.tools.assert_equals(other.poll(), -signal.SIGTERM)
+
+
+def test_Zygote_preload_output_and_errors():
+    if sys.version_info[0] == 2 or not hasattr(os, 'fork'):
+        raise nose.SkipTest('requires Python 3 and os.fork')
+
+    with temporary_directory() as tmp:
+        with open(os.path.join(tmp, 'noisy_mod.py'), 'w') as f:
+            f.write('print("imported noisy_mod")\n')
+        with open(os.path.join(tmp, 'broken_mod.py'), 'w') as f:
+            f.write('raise RuntimeError("broken")\n')
+        zygote = newtabmagic.Zygote(['noisy_mod', 'broken_mod'])
+        env = dict(os.environ, PYTHONPATH=tmp)
+        with patch.dict(os.environ, env):
+            zygote.start()
+        try:
+            with patch('sys.stdout', StringIO()) as out:
+                processes = []
+                for _ in range(2):
+                    port = newtabmagic._port_not_in_use()
+                    process = zygote.fork_server(port)
+                    processes.append(process)
+                    url = 'http://127.0.0.1:{}{}'.format(
+                        port, newtabmagic.STATS_PATH)
+                    stats = json.loads(urlopen(url).read().decode('utf-8'))
+                    nose.tools.assert_equals(stats['pid'], process.pid)
+            nose.tools.assert_equals(
+                out.getvalue(), 'Zygote could not import broken_mod: '
+                'RuntimeError: broken\n')
+            nose.tools.assert_equals(sorted(zygote.preload_errors),
+                                     ['broken_mod'])
+            assert 'not imported: broken_mod' in str(zygote)
+        finally:
+            zygote.stop()
+
+
+def test_set_zygote():
+    if not hasattr(os, 'fork'):
+        raise nose.SkipTest('requires os.fork')
+
+    newtab = _get_newtabmagic()
+    with patch.object(newtabmagic.Zygote, 'start') as start:
+        newtab.newtab('--zygote json')
+    nose.tools.assert_equals(start.call_count, 1)
+    nose.tools.assert_equals(newtab._server.zygote.preload, ['json'])
+    with patch.object(newtabmagic.Zygote, 'stop'):
+        newtab.newtab('--no-zygote')
+    nose.tools.assert_equals(newtab._server.zygote, None)
+
+
+def test_DocServer_keep_alive():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+    import http.client
+
+    with doc_server(keep_alive_timeout=0.5) as server:
+        conn = http.client.HTTPConnection('127.0.0.1',
+                                          server.server_address[1])
+        try:
+            socks = []
+            for path in ['/json.html', '/pydoc_data/_pydoc.css', '/']:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                body = response.read()
+                nose.tools.assert_equals(response.version, 11)
+                nose.tools.assert_equals(
+                    int(response.getheader('Content-Length')), len(body))
+                socks.append(conn.sock)
+            # One connection for all requests.
+            assert socks[0] is not None
+            assert all(sock is socks[0] for sock in socks)
+
+            # The server closes the connection once it is idle.
+            time.sleep(1.0)
+            nose.tools.assert_equals(conn.sock.recv(1), b'')
+        finally:
+            conn.close()
+
+
+def _live_class():
+    """Return a class that the doc server process cannot import."""
+    return type('Live', (object,), {'__module__': '__main__',
+                                    '__doc__': 'LiveDocstring'})
+
+
+def test_LiveDocs():
+    live = newtabmagic.LiveDocs()
+    nose.tools.assert_equals(live.page('__main__.Live'), None)
+
+    cls = _live_class()
+    live.register('__main__.Live', cls)
+    page = live.page('__main__.Live')
+    assert 'LiveDocstring' in page
+    assert live.page('__main__.Live') is page
+
+    # A new object under the same name is rendered again.
+    cls2 = _live_class()
+    cls2.__doc__ = 'Redefined'
+    live.register('__main__.Live', cls2)
+    assert 'Redefined' in live.page('__main__.Live')
+
+
+def test_LiveDocs_server():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+
+    live = newtabmagic.LiveDocs()
+    live.register('__main__.Live', _live_class())
+    url = live.start()
+    nose.tools.assert_equals(live.start(), url)
+
+    with doc_server(live_url=url) as server:
+        _, body = _get(_server_url(server) + '__main__.Live.html')
+        assert b'LiveDocstring' in body
+
+        # Pages the kernel does not have are rendered by pydoc.
+        _, body = _get(_server_url(server) + '__main__.Dead.html')
+        assert b'LiveDocstring' not in body
+        _, body = _get(_server_url(server) + 'json.html')
+        assert b'JSON' in body
+
+
+def test_newtab_registers_live_object():
+    newtab = _get_newtabmagic()
+    cls = _live_class()
+    newtab.shell.push({'Live': cls, 'live': cls()})
+    _open_new_tab(newtab, 'Live')
+    assert newtab._live_docs.page('__main__.Live') is not None
+    nose.tools.assert_equals(newtab._server.live_docs, newtab._live_docs)
+
+
+def test_LiveDocs_redefined_in_user_ns():
+    newtab = _get_newtabmagic()
+    newtab.shell.push({'Live': _live_class()})
+    _open_new_tab(newtab, 'Live')
+    assert 'LiveDocstring' in newtab._live_docs.page('__main__.Live')
+
+    # Redefined without running %newtab again.
+    cls = _live_class()
+    cls.__doc__ = 'Redefined'
+    newtab.shell.push({'Live': cls})
+    newtab.shell.events.trigger('post_execute')
+    try:
+        assert 'Redefined' in newtab._live_docs.page('__main__.Live')
+        nose.tools.assert_equals(
+            newtab._live_docs.json('__main__.Live')['doc'], 'Redefined')
+    finally:
+        newtab.shell.events.unregister('post_execute',
+                                       newtab._refresh_live_docs)
+
+
+def test_LiveDocs_serves_registered_objects_only():
+    calls = []
+
+    class Noisy(object):
+        @property
+        def prop(self):
+            calls.append(threading.current_thread().name)
+            return _live_class()
+
+    live = newtabmagic.LiveDocs()
+    live.refresh({'noisy': Noisy(), 'Live': _live_class()})
+    nose.tools.assert_equals(live.page('__main__.Live'), None)
+    nose.tools.assert_equals(live.page('__main__.noisy.prop'), None)
+    nose.tools.assert_equals(calls, [])
+
+    # The HTTP server is started once an object is registered.
+    url = live.start()
+    assert not live.running()
+    live.register('__main__.Live', _live_class())
+    nose.tools.assert_equals(live.start(), url)
+    try:
+        assert live.running()
+        try:
+            urlopen(url + '__main__.noisy.prop.html', timeout=5)
+        except HTTPError as e:
+            nose.tools.assert_equals(e.code, 404)
+        else:
+            raise AssertionError('HTTPError not raised')
+        body = urlopen(url + '__main__.Live.html', timeout=5).read()
+        assert b'LiveDocstring' in body
+    finally:
+        live.stop()
+    assert not live.running()
+    nose.tools.assert_equals(calls, [])
+
+
+def test_newtab_registers_patched_object():
+    newtab = _get_newtabmagic()
+    func = types.FunctionType(_live_function.__code__, {}, 'live_dumps')
+    func.__module__ = '__main__'
+    func.__qualname__ = 'live_dumps'
+    with patch('json.dumps', func):
+        page_name = newtab._get_pydoc_page_name('json.dumps')
+    nose.tools.assert_equals(page_name, '__main__.live_dumps')
+    assert newtab._live_docs.page(page_name) is not None
+
+
+def _live_function():
+    """LiveFunction"""
+
+
+def test_DocWarmer():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+
+    with doc_server() as server:
+        process = newtabmagic.ServerProcess()
+        process.port = server.server_address[1]
+        warmer = newtabmagic.DocWarmer(process, max_warming=1)
+        warmer.deny = ['denied']
+        modules = {'warm_a': object(), 'warm_b': object(),
+                   'denied': object(), '_private': object()}
+        with patch.dict(sys.modules, modules):
+            with patch.object(process, 'running', return_value=False):
+                warmer.post_execute()
+            # Nothing is warmed until the server is running.
+            out = StringIO()
+            with patch('sys.stdout', out):
+                warmer.show()
+            assert 'warm queue: 2 queued, 0 warming, 0 warmed' in \
+                out.getvalue()
+
+            with patch.object(process, 'running', return_value=True):
+                warmer.post_execute()
+            deadline = time.time() + 10
+            while warmer.warmed < 2 and time.time() < deadline:
+                time.sleep(0.05)
+        nose.tools.assert_equals(warmer.warmed, 2)
+        nose.tools.assert_equals(warmer.failures, 0)
+
+
+def test_DocWarmer_allow():
+    warmer = newtabmagic.DocWarmer(newtabmagic.ServerProcess())
+    warmer.allow = ['pandas']
+    assert warmer._wanted('pandas')
+    assert not warmer._wanted('numpy')
+    warmer.allow = []
+    assert warmer._wanted('numpy')
+
+
+def test_DocWarmer_failures():
+    try:
+        from http.client import IncompleteRead
+    except ImportError:
+        from httplib import IncompleteRead
+
+    warmer = newtabmagic.DocWarmer(newtabmagic.ServerProcess())
+    errors = [IncompleteRead(b''), IOError('refused'), None]
+
+    def fetch(url, timeout):
+        error = errors.pop(0)
+        if error is not None:
+            raise error
+        return StringIO()
+
+    warmer._queue = ['a', 'b', 'c']
+    warmer._warming = 1
+    with patch('newtabmagic.urlopen', side_effect=fetch):
+        warmer._warm_queued()
+    nose.tools.assert_equals(warmer.warmed, 1)
+    nose.tools.assert_equals(warmer.failures, 2)
+    nose.tools.assert_equals(warmer._warming, 0)
+
+    # A thread ended by any exception frees its place.
+    warmer._queue = ['d']
+    warmer._warming = 1
+    with patch('newtabmagic.urlopen', side_effect=SystemExit):
+        nose.tools.assert_raises(SystemExit, warmer._warm_queued)
+    nose.tools.assert_equals(warmer._warming, 0)
+
+
+def test_set_warm():
+    newtab = _get_newtabmagic()
+    callbacks = newtab.shell.events.callbacks['post_execute']
+    newtab.newtab('--warm --warm-limit 3 --warm-deny numpy')
+    try:
+        assert newtab._warmer.post_execute in callbacks
+        nose.tools.assert_equals(newtab._warmer.max_warming, 3)
+        nose.tools.assert_equals(newtab._warmer.deny, ['numpy'])
+    finally:
+        newtab.newtab('--no-warm')
+    assert newtab._warmer.post_execute not in callbacks
+
+
+def _get_json(url):
+    return json.loads(urlopen(url).read().decode('utf-8'))
+
+
+def test_DocServer_json():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+
+    with doc_server() as server:
+        url = _server_url(server) + '__newtab_json/'
+        doc = _get_json(url + 'json.dumps')
+        nose.tools.assert_equals(doc['kind'], 'function')
+        assert doc['signature'].startswith('(obj, ')
+        assert doc['doc'].startswith('Serialize')
+        assert doc['file'].endswith(os.path.join('json', '__init__.py'))
+        assert doc['line'] > 1
+        nose.tools.assert_equals(doc['members'], [])
+
+        doc = _get_json(url + 'json?offset=1&limit=2')
+        nose.tools.assert_equals(doc['kind'], 'module')
+        nose.tools.assert_equals(doc['offset'], 1)
+        nose.tools.assert_equals(len(doc['members']), 2)
+        nose.tools.assert_equals(doc['next_offset'], 3)
+        assert doc['members_total'] > 3
+        names = [m['name'] for m in _get_json(url + 'json')['members']]
+        nose.tools.assert_equals(names[1:3],
+                                 [m['name'] for m in doc['members']])
+        assert 'JSONDecoder' in names
+        member = doc['members'][0]
+        nose.tools.assert_equals(member['page'], 'json.' + member['name'])
+
+        try:
+            urlopen(url + 'no_such_module_xyz')
+        except IOError as e:
+            nose.tools.assert_equals(e.code, 404)
+        else:
+            raise AssertionError('expected 404')
+
+        cache = server.stats()['caches']['json']
+    nose.tools.assert_equals(cache, {'hits': 1, 'misses': 3})
+
+
+def test_DocServer_json_live():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+
+    live = newtabmagic.LiveDocs()
+    live.register('__main__.Live', _live_class())
+    with doc_server(live_url=live.start()) as server:
+        doc = _get_json(_server_url(server) + '__newtab_json/__main__.Live')
+    nose.tools.assert_equals(doc['doc'], 'LiveDocstring')
+    nose.tools.assert_equals(doc['kind'], 'class')
+
+
+def test_newtab_json():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+
+    newtab = _get_newtabmagic()
+    with doc_server() as server:
+        newtab._server.port = server.server_address[1]
+        with patch.object(newtabmagic.ServerProcess, 'running',
+                          return_value=True):
+            doc = newtab.newtab('--json json.JSONDecoder --json-offset 1')
+            nose.tools.assert_equals(doc['name'], 'json.JSONDecoder')
+            nose.tools.assert_equals(doc['offset'], 1)
+            output = _newtabmagic_message(newtab, '--json no_such_name')
+    nose.tools.assert_equals(output, 'Documentation not found: no_such_name\n')
+
+
+def test_newtab_json_async():
+    newtab = _get_newtabmagic()
+    with patch.object(newtab, '_get_json', return_value={}) as get_json:
+        nose.tools.assert_raises(UsageError, newtab.newtab,
+                                 '--async --json json')
+        nose.tools.assert_equals(get_json.call_count, 0)
+        # --json runs in the foreground whatever the default.
+        newtab.async_default = True
+        nose.tools.assert_equals(newtab.newtab('--json json'), {})
+        get_json.assert_called_once_with('json', 0)
+
+
+def test_doc_json_members():
+    import json.decoder
+    doc = newtabmagic.doc_json(json.JSONDecoder, 'json.JSONDecoder')
+    names = [m['name'] for m in doc['members']]
+    # As on the pydoc page: nothing inherited from object.
+    nose.tools.assert_equals(
+        names, ['__dict__', '__init__', '__weakref__', 'decode',
+                'raw_decode'])
+
+    # Modules list the classes and functions they define.
+    doc = newtabmagic.doc_json(newtabmagic, 'newtabmagic')
+    names = [m['name'] for m in doc['members']]
+    assert 'NewTabMagics' in names
+    assert 'Magics' not in names
+    assert 'doc_json' in names
+
+
+def test_parse_server_timing():
+    timing = newtabmagic._parse_server_timing(
+        'import;dur=12.5, render;desc="x";dur=3, bad;dur=x, nodur')
+    nose.tools.assert_equals(timing, {'import': 12.5, 'render': 3.0})
+
+
+def test_ServerProcess_profile_page():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+
+    with doc_server() as server:
+        process = newtabmagic.ServerProcess()
+        process.port = server.server_address[1]
+        with patch.object(process, 'running', return_value=True):
+            timing, profile = process.profile_page('json.decoder')
+    nose.tools.assert_equals(sorted(timing), ['import', 'render'])
+    assert timing['render'] > 0
+    names = set(func[2] for func in profile)
+    assert 'locate' in names
+    assert '_url_handler' in names
+    # Profiles are given out once.
+    nose.tools.assert_equals(server.pop_profile('x'), None)
+
+
+def test_newtab_profile():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+
+    newtab = _get_newtabmagic()
+    with temporary_directory() as tmp:
+        path = os.path.join(tmp, 'newtab.pstats')
+        with doc_server() as server:
+            newtab._server.port = server.server_address[1]
+            with patch.object(newtabmagic.ServerProcess, 'running',
+                              return_value=True):
+                output, mock_call = _open_new_tab(
+                    newtab, '--profile json.JSONDecoder --profile-top 5 '
+                    '--profile-out ' + path)
+        stats = pstats.Stats(path)
+
+    lines = output.split('\n')
+    stages = [line.split(':')[0] for line in lines[:9]]
+    nose.tools.assert_equals(stages, [
+        'name lookup', '  user namespace', '  fullqualname',
+        '  pydoc.locate', 'server page', '  server import',
+        '  server render', 'browser launch', 'total'])
+    assert 'Ordered by: internal time' in output
+    assert 'Profile saved to ' + path in output
+    url = newtab.base_url + 'json.JSONDecoder.html'
+    mock_call.assert_called_once_with([newtab.browser, url])
+    # The saved profile has both the kernel's and the server's calls.
+    names = set(func[2] for func in stats.stats)
+    assert '_get_pydoc_page_name' in names
+    assert '_url_handler' in names
+
+
+def test_SourceFile():
+    with temporary_directory() as tmp:
+        path = os.path.join(tmp, 'mod.py')
+        with open(path, 'wb') as f:
+            f.write(b''.join(b'x = "<%d>"\n' % i for i in range(2500)))
+        source = newtabmagic.SourceFile(path)
+        nose.tools.assert_equals(source.line_count, 2500)
+        # Across block boundaries.
+        lines = source.lines(1020, 1030)
+        nose.tools.assert_equals(len(lines), 10)
+        nose.tools.assert_equals(lines[0], 'x = "&lt;1020&gt;"')
+        nose.tools.assert_equals(source.lines(2499, 2500),
+                                 ['x = "&lt;2499&gt;"'])
+
+        empty = os.path.join(tmp, 'empty.py')
+        open(empty, 'w').close()
+        source = newtabmagic.SourceFile(empty)
+        nose.tools.assert_equals(source.line_count, 0)
+        nose.tools.assert_equals(source.lines(0, 0), [])
+
+
+def test_SourceFiles_changed_file():
+    with temporary_directory() as tmp:
+        path = os.path.join(tmp, 'source_files_mod.py')
+        with open(path, 'w') as f:
+            f.write('class C(object):\n    pass\n')
+        sys.path.insert(0, tmp)
+        try:
+            files = newtabmagic.SourceFiles()
+            source, line = files.get('source_files_mod.C')
+            nose.tools.assert_equals(line, 1)
+            nose.tools.assert_equals(files.get('source_files_mod.C')[1], 1)
+
+            # Lines added above the class move its definition.
+            with open(path, 'w') as f:
+                f.write('"""Doc."""\n\n\nclass C(object):\n    pass\n')
+            source, line = files.get('source_files_mod.C')
+            nose.tools.assert_equals(line, 4)
+            nose.tools.assert_equals(source.line_count, 5)
+        finally:
+            sys.path.remove(tmp)
+            sys.modules.pop('source_files_mod', None)
+
+
+def test_parse_range():
+    parse = newtabmagic._parse_range
+    nose.tools.assert_equals(parse(None, 100), None)
+    nose.tools.assert_equals(parse('bytes=0-9', 100), (0, 9))
+    nose.tools.assert_equals(parse('bytes=90-', 100), (90, 99))
+    nose.tools.assert_equals(parse('bytes=-10', 100), (90, 99))
+    nose.tools.assert_equals(parse('bytes=50-500', 100), (50, 99))
+    nose.tools.assert_equals(parse('bytes=0-1,5-6', 100), None)
+    nose.tools.assert_raises(ValueError, parse, 'bytes=100-', 100)
+
+
+def test_DocServer_source():
+    if sys.version_info[0] == 2:
+        raise nose.SkipTest('DocServer requires Python 3')
+    import json.decoder
+    path = json.decoder.__file__
+    with open(path, 'rb') as f:
+        data = f.read()
+    line = inspect.getsourcelines(json.decoder.JSONDecoder)[1]
+
+    with doc_server() as server:
+        url = _server_url(server) + '__newtab_source/'
+        # The module page links to the source view.
+        _, body = _get(_server_url(server) + 'json.decoder.html')
+        assert b'href="/__newtab_source/json.decoder"' in body
+
+        # The view starts just before the definition.
+        _, body = _get(url + 'json.decoder.JSONDecoder?count=20')
+        body = body.decode('utf-8')
+        first = line - newtabmagic.SOURCE_CONTEXT
+        assert '<span id="L{}">'.format(first) in body
+        assert '<span id="L{}">'.format(first - 1) not in body
+        assert '<span id="L{}">'.format(first + 20) not in body
+        assert '<strong><span id="L{}">'.format(line) in body
+        assert 'class JSONDecoder(object):' in body
+
+        headers, body = _get(url + 'json.decoder?raw')
+        nose.tools.assert_equals(body, data)
+        nose.tools.assert_equals(headers['Accept-Ranges'], 'bytes')
+
+        response = urlopen(Request(url + 'json.decoder?raw',
+                                   headers={'Range': 'bytes=10-19'}))
+        nose.tools.assert_equals(response.getcode(), 206)
+        nose.tools.assert_equals(response.read(), data[10:20])
+        nose.tools.assert_equals(response.info()['Content-Range'],
+                                 'bytes 10-19/{}'.format(len(data)))
+
+        try:
+            urlopen(url + 'sys')
+        except IOError as e:
+            nose.tools.assert_equals(e.code, 404)
+        else:
+            raise AssertionError('expected 404')
+
+        cache = server.stats()['caches']['source']
+    nose.tools.assert_equals(cache, {'hits': 2, 'misses': 1})
+
+
+def test_newtab_source():
+    newtab = _get_newtabmagic()
+    output, mock_call = _open_new_tab(newtab, '--source json.JSONDecoder')
+    nose.tools.assert_equals(output, '')
+    url = newtab.base_url + '__newtab_source/json.JSONDecoder'
+    mock_call.assert_called_once_with([newtab.browser, url])
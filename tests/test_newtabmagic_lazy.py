@@ -0,0 +1,70 @@
+"""Tests for newtabmagic_lazy.
+
+To run tests:
+
+    nosetests
+
+"""
+# pylint: disable=C0111
+import os
+import subprocess
+import sys
+
+import IPython
+import nose
+import newtabmagic
+import newtabmagic_lazy
+
+if sys.version_info.major == 2:
+    from StringIO import StringIO
+else:
+    from io import StringIO
+
+if sys.version_info >= (3, 3):
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+if not IPython.get_ipython():
+    from IPython.testing import globalipapp
+    globalipapp.start_ipython()
+
+
+def test_register():
+    ip = IPython.get_ipython()
+    newtabmagic_lazy.register(ip, port=8880, browser='firefox')
+    stub = ip.find_line_magic('newtab')
+    nose.tools.assert_equals(stub.__name__, 'newtab')
+    assert not isinstance(getattr(stub, '__self__', None),
+                          newtabmagic.NewTabMagics)
+
+    with patch('sys.stdout', StringIO()) as out:
+        ip.run_line_magic('newtab', '--show')
+    output = out.getvalue()
+    assert 'browser: firefox\n' in output
+    assert 'server port: 8880\n' in output
+
+    # The stub has been replaced.
+    magics = ip.find_line_magic('newtab').__self__
+    assert isinstance(magics, newtabmagic.NewTabMagics)
+    nose.tools.assert_equals(magics.port, 8880)
+
+    # Loading the extension again keeps the settings.
+    assert 'newtabmagic' in ip.extension_manager.loaded
+    ip.run_line_magic('load_ext', 'newtabmagic')
+    nose.tools.assert_equals(ip.find_line_magic('newtab').__self__, magics)
+    nose.tools.assert_equals(magics.port, 8880)
+    nose.tools.assert_equals(magics.browser, 'firefox')
+
+
+def test_register_does_not_import_newtabmagic():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = ('import sys\n'
+            'sys.path.insert(0, {!r})\n'
+            'from IPython.core.interactiveshell import InteractiveShell\n'
+            'import newtabmagic_lazy\n'
+            'ip = InteractiveShell.instance()\n'
+            'newtabmagic_lazy.register(ip, port=8880)\n'
+            'print("newtabmagic" in sys.modules)\n').format(root)
+    output = subprocess.check_output([sys.executable, '-c', code])
+    nose.tools.assert_equals(output.decode('ascii').split()[-1], 'False')